@@ -22,6 +22,8 @@ __email__ = 'romanz@lavabit.com'
 RANGERDIR = os.path.dirname(__file__)
 TICKS_BEFORE_COLLECTING_GARBAGE = 100
 TIME_BEFORE_FILE_BECOMES_GARBAGE = 1200
+FRAME_INTERVAL = 0.05  # seconds between redraws while the loader works
+IDLE_INTERVAL = 2      # seconds between redraws otherwise
 MAX_RESTORABLE_TABS = 3
 MACRO_DELIMITER = '%'
 DEFAULT_PAGER = 'less'
@@ -13,6 +13,7 @@ from ranger.ext.lazy_property import lazy_property
 
 SETTINGS_RE = re.compile(r'^\s*([^\s]+?)=(.*)$')
 DELETE_WARNING = 'delete seriously? '
+BULKRENAME_WARNING = 'bulkrename apply? '
 
 def alias(*_): pass # COMPAT
 
@@ -606,6 +606,19 @@ class save_copy_buffer(Command):
 		f.close()
 
 
+class resume_copy(Command):
+	"""
+	:resume_copy [discard]
+
+	Resume the copy and move jobs which were interrupted, e.g. by a crash.
+	With "discard", forget them instead.  See the setting journal_copies.
+	"""
+	def execute(self):
+		count = self.fm.resume_copies(discard=self.arg(1) == 'discard')
+		if not count:
+			self.fm.notify("There is no interrupted copy job")
+
+
 class unmark(mark):
 	"""
 	:unmark <regexp>
@@ -784,21 +797,34 @@ class bulkrename(Command):
 	:bulkrename
 
 	This command opens a list of selected files in an external editor.
-	After you edit and save the file, it will generate a shell script
-	which does bulk renaming according to the changes you did in the file.
+	After you edit and save the file, the renames are shown for you to
+	review and you're asked for a confirmation: The last word in the line
+	has to start with a 'y'.
 
-	This shell script is opened in an editor for you to review.
-	After you close it, it will be executed.
+	The files are then renamed in an order which allows e.g. swapping
+	the names of two files.
 	"""
+
+	allow_abbrev = False
+	pending = None  # the renames which wait for a confirmation
+
 	def execute(self):
+		if self.line.startswith(BULKRENAME_WARNING):
+			renames, bulkrename.pending = bulkrename.pending, None
+			if renames and self.arg(-1).startswith('y'):
+				self.fm.rename_files(renames)
+			return
+
 		import sys
 		import tempfile
 		from ranger.fsobject.file import File
-		from ranger.ext.shell_escape import shell_escape as esc
+		from ranger.ext.rename_plan import plan_renames
 		py3 = sys.version > "3"
 
 		# Create and edit the file list
-		filenames = [f.basename for f in self.fm.thistab.get_selection()]
+		cwd = self.fm.thisdir.path
+		selection = self.fm.thistab.get_selection()
+		filenames = [f.basename for f in selection]
 		listfile = tempfile.NamedTemporaryFile()
 
 		if py3:
@@ -813,25 +839,31 @@ class bulkrename(Command):
 		else:
 			new_filenames = listfile.read().split("\n")
 		listfile.close()
+		if len(new_filenames) == len(filenames) + 1 and not new_filenames[-1]:
+			del new_filenames[-1]  # the newline which editors add at the end
+		if len(new_filenames) != len(filenames):
+			self.fm.notify("The number of lines has changed!", bad=True)
+			return
 		if all(a == b for a, b in zip(filenames, new_filenames)):
 			self.fm.notify("No renaming to be done!")
 			return
 
-		# Generate and execute script
-		cmdfile = tempfile.NamedTemporaryFile()
-		cmdfile.write(b"# This file will be executed when you close the editor.\n")
-		cmdfile.write(b"# Please double-check everything, clear the file to abort.\n")
-		if py3:
-			cmdfile.write("\n".join("mv -vi -- " + esc(old) + " " + esc(new) \
-				for old, new in zip(filenames, new_filenames) \
-				if old != new).encode("utf-8"))
-		else:
-			cmdfile.write("\n".join("mv -vi -- " + esc(old) + " " + esc(new) \
-				for old, new in zip(filenames, new_filenames) if old != new))
-		cmdfile.flush()
-		self.fm.execute_file([File(cmdfile.name)], app='editor')
-		self.fm.run(['/bin/sh', cmdfile.name], flags='w')
-		cmdfile.close()
+		renames = [(f.path, os.path.normpath(os.path.join(cwd, new)))
+				for f, new in zip(selection, new_filenames)
+				if f.basename != new]
+		try:
+			plan = plan_renames(renames)
+		except ValueError as err:
+			self.fm.notify(err, bad=True)
+			return
+
+		bulkrename.pending = renames
+		self.fm.open_console(BULKRENAME_WARNING)
+		lines = ["Renaming %d files like this.  Confirm in the console "
+				"with 'y', press q to get there." % len(renames), ""]
+		lines.extend("%s -> %s" % (os.path.relpath(src, cwd),
+				os.path.relpath(dst, cwd)) for src, dst in plan)
+		self.fm.ui.open_pager().set_source(lines)
 
 
 class relink(Command):
@@ -1033,3 +1065,26 @@ class grep(Command):
 			action.extend(['-e', self.rest(1), '-r'])
 			action.extend(f.path for f in self.fm.thistab.get_selection())
 			self.fm.execute_command(action, flags='p')
+
+
+class preview_cache(Command):
+	"""
+	:preview_cache [clear]
+
+	Shows how many previews are cached, how often they were found there
+	and how many were dropped to stay within the setting preview_cache_size.
+	With "clear", the cached previews are dropped, also the ones on the
+	disk if persistent_preview_cache is on.
+	"""
+
+	def execute(self):
+		persistent = self.fm.settings.persistent_preview_cache \
+				and self.fm.persistent_previews
+		if self.arg(1) == 'clear':
+			self.fm.previews.clear()
+			if persistent:
+				persistent.clear()
+		summary = "Preview cache: " + self.fm.previews.summary()
+		if persistent:
+			summary += "; " + persistent.summary()
+		self.fm.notify(summary)
@@ -0,0 +1,301 @@
+# Copyright (C) 2009, 2010, 2011  Roman Zimbelmann <romanz@lavabit.com>
+# This software is distributed under the terms of the GNU GPL version 3.
+
+"""
+The output of the preview script, limited to a budget of bytes.
+
+For each path, there is a dict of the previews in different sizes:
+
+	cache.use('/tmp/foo.jpg')[(80, 24)] = "the content..."
+	cache.use('/tmp/foo.jpg')['loading'] = False
+
+A -1 in the tuples means "any"; (80, -1) = width of 80 and any height.
+The key 'foundpreview' is added later.  Values in (True, False)
+
+When the previews take more bytes than the budget, the ones of the paths
+which weren't used for the longest time are evicted.  Paths whose preview
+is still loading are kept.
+
+>>> cache = PreviewCache(budget=10)
+>>> cache.store('/a', cache.use('/a'), (80, 24), 'x' * 6)
+>>> cache.find('/a', 80, 24)
+'xxxxxx'
+>>> cache.store('/b', cache.use('/b'), (-1, -1), 'y' * 6)
+>>> '/a' in cache, '/b' in cache, cache.size
+(False, True, 6)
+>>> cache.find('/b', 20, 10), cache.find('/a', 80, 24)
+('yyyyyy', False)
+>>> cache.hits, cache.misses, cache.evictions
+(2, 1, 1)
+
+A PersistentPreviewCache keeps previews in files, so they survive a
+restart of ranger.  They are found by the hash of the realpath, st_size
+and st_mtime of the previewed file and the size of the preview:
+
+>>> import tempfile, shutil
+>>> directory = tempfile.mkdtemp()
+>>> st = os.stat_result((0, 0, 0, 0, 0, 0, 5000, 0, 7, 0))
+>>> disk = PersistentPreviewCache(directory, budget=10)
+>>> disk.save('/a', st, (-1, 24), True, 'x' * 6)
+>>> disk.load('/a', st, 80, 24)
+((-1, 24), True, 'xxxxxx')
+>>> disk.load('/a', st, 80, 30) is None
+True
+>>> disk.save('/b', st, (-1, -1), False, None)
+>>> disk.load('/b', st, 80, 24)
+((-1, -1), False, None)
+>>> disk.hits, disk.misses
+(2, 1)
+>>> shutil.rmtree(directory)
+"""
+
+import os
+import hashlib
+from collections import deque
+from ranger.core.shared import SettingsAware
+from ranger.ext.human_readable import human_readable
+
+MEGABYTE = 1024 * 1024
+
+class PreviewCache(SettingsAware):
+	def __init__(self, budget=None):
+		"""The budget is in bytes, by default the setting preview_cache_size"""
+		self.budget = budget
+		self.entries = {}     # path => dict of previews
+		self.sizes = {}       # path => the bytes of its previews
+		self.last_used = {}   # path => tick
+		self.queue = deque()  # (tick, path) in the order of use
+		self.tick = 0
+		self.size = 0
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+	def __contains__(self, path):
+		return path in self.entries
+
+	def __getitem__(self, path):
+		return self.entries[path]
+
+	def __delitem__(self, path):
+		del self.entries[path]
+		self.size -= self.sizes.pop(path)
+		del self.last_used[path]
+
+	def __len__(self):
+		return len(self.entries)
+
+	def get_budget(self):
+		if self.budget is not None:
+			return self.budget
+		return self.settings.preview_cache_size * MEGABYTE
+
+	def use(self, path):
+		"""The dict of the previews of path, which is marked as recently used"""
+		self.tick += 1
+		self.last_used[path] = self.tick
+		self.queue.append((self.tick, path))
+		if len(self.queue) > 2 * len(self.last_used) + 100:
+			# Drop the outdated ticks of paths which were used again
+			self.queue = deque(sorted((tick, path)
+					for path, tick in self.last_used.items()))
+		try:
+			return self.entries[path]
+		except KeyError:
+			self.sizes[path] = 0
+			data = self.entries[path] = {'loading': False}
+			return data
+
+	def find(self, path, width, height, count=True):
+		"""
+		The preview of path in that size or False if it isn't cached.
+		With count=False, it's not counted as a hit or a miss.
+		"""
+		data = self.entries.get(path)
+		if data is None:
+			found = False
+		else:
+			found = data.get((-1, -1), data.get((width, -1),
+				data.get((-1, height), data.get((width, height), False))))
+		if not count:
+			pass
+		elif found is False:
+			self.misses += 1
+		else:
+			self.hits += 1
+		return found
+
+	def store(self, path, data, key, content):
+		"""
+		Put a preview into data, which use(path) returned before, and
+		evict old previews if the budget is exceeded
+		"""
+		old = data.get(key)
+		data[key] = content
+		if self.entries.get(path) is not data:
+			return  # it was removed while loading
+		difference = len(content or '') - len(old or '')
+		self.sizes[path] += difference
+		self.size += difference
+
+		budget = self.get_budget()
+		if budget <= 0:
+			return
+		requeue = []
+		while self.size > budget and self.queue:
+			tick, oldest = self.queue.popleft()
+			if self.last_used.get(oldest) != tick:
+				continue
+			if oldest == path or self.entries[oldest]['loading']:
+				requeue.append((tick, oldest))
+				continue
+			del self[oldest]
+			self.evictions += 1
+		self.queue.extendleft(reversed(requeue))
+
+	def clear(self):
+		self.entries.clear()
+		self.sizes.clear()
+		self.last_used.clear()
+		self.queue.clear()
+		self.size = 0
+
+	def summary(self):
+		budget = self.get_budget()
+		if budget > 0:
+			budget = human_readable(budget)
+		else:
+			budget = "unlimited"
+		return "%d previews, %s of %s, %d hits, %d misses, %d evictions" % (
+				len(self.entries), human_readable(self.size), budget,
+				self.hits, self.misses, self.evictions)
+
+class PersistentPreviewCache(SettingsAware):
+	# Remove this much more than needed, so it's not done after every save
+	headroom = 0.25
+
+	def __init__(self, directory, budget=None):
+		"""
+		The budget is in bytes, by default the setting
+		persistent_preview_cache_size
+		"""
+		self.directory = directory
+		self.budget = budget
+		self.size = None  # the bytes in the directory, once they're known
+		self.hits = 0
+		self.misses = 0
+
+	def get_budget(self):
+		if self.budget is not None:
+			return self.budget
+		return self.settings.persistent_preview_cache_size * MEGABYTE
+
+	def _filename(self, path, st, key):
+		identity = repr((path, st.st_size, st.st_mtime) + tuple(key))
+		return os.path.join(self.directory,
+				hashlib.sha1(identity.encode('utf-8')).hexdigest())
+
+	def load(self, path, st, width, height):
+		"""
+		Returns the tuple (key, foundpreview, content) of the cached preview
+		or None.  st is the os.stat() of path.
+		"""
+		for key in ((-1, -1), (width, -1), (-1, height), (width, height)):
+			filename = self._filename(path, st, key)
+			try:
+				f = open(filename, 'rb')
+			except IOError:
+				continue
+			try:
+				found = f.readline() == b'1\n'
+				content = f.read()
+			finally:
+				f.close()
+			try:
+				os.utime(filename, None)  # for removing the oldest ones
+			except OSError:
+				pass
+			self.hits += 1
+			if not found:
+				content = None
+			elif not isinstance(content, str):
+				content = content.decode('utf-8', 'replace')
+			return key, found, content
+		self.misses += 1
+		return None
+
+	def save(self, path, st, key, found, content):
+		"""Store the preview of path which load() should find"""
+		if found:
+			content = content or b''
+			if not isinstance(content, bytes):
+				content = content.encode('utf-8', 'replace')
+			content = b'1\n' + content
+		else:
+			content = b'0\n'
+		filename = self._filename(path, st, key)
+		try:
+			if not os.path.isdir(self.directory):
+				os.makedirs(self.directory)
+			f = open(filename + '.tmp', 'wb')
+			try:
+				f.write(content)
+			finally:
+				f.close()
+			os.rename(filename + '.tmp', filename)
+		except (IOError, OSError):
+			return
+		if self.size is None:
+			self.clean()
+		else:
+			self.size += len(content)
+			if self.size > self.get_budget():
+				self.clean()
+
+	def clean(self):
+		"""Remove the oldest previews until they fit into the budget"""
+		files = []
+		self.size = 0
+		try:
+			names = os.listdir(self.directory)
+		except OSError:
+			return
+		for name in names:
+			filename = os.path.join(self.directory, name)
+			try:
+				st = os.stat(filename)
+			except OSError:
+				continue
+			files.append((st.st_mtime, st.st_size, filename))
+			self.size += st.st_size
+		budget = self.get_budget()
+		if self.size <= budget:
+			return
+		budget -= budget * self.headroom
+		files.sort()
+		for mtime, size, filename in files:
+			if self.size <= budget:
+				break
+			try:
+				os.remove(filename)
+			except OSError:
+				continue
+			self.size -= size
+
+	def clear(self):
+		budget, self.budget = self.budget, -1
+		try:
+			self.clean()
+		finally:
+			self.budget = budget
+
+	def summary(self):
+		if self.size is None:
+			self.clean()
+		return "%s of %s on the disk, %d hits, %d misses" % (
+				human_readable(self.size),
+				human_readable(self.get_budget()), self.hits, self.misses)
+
+if __name__ == '__main__':
+	import doctest
+	doctest.testmod()
@@ -9,10 +9,14 @@ import re
 ALLOWED_SETTINGS = {
 	'autosave_bookmarks': bool,
 	'autoupdate_cumulative_size': bool,
+	'checksum_algorithm': str,
 	'collapse_preview': bool,
 	'colorscheme': str,
 	'column_ratios': (tuple, list),
 	'confirm_on_delete': str,
+	'copy_bandwidth': (int, float),
+	'copy_io_priority': str,
+	'copy_threads': int,
 	'dirname_in_tabs': bool,
 	'display_size_in_main_column': bool,
 	'display_size_in_status_bar': bool,
@@ -21,13 +25,24 @@ ALLOWED_SETTINGS = {
 	'draw_progress_bar_in_status_bar': bool,
 	'flushinput': bool,
 	'hidden_filter': (str, type(re.compile(""))), #COMPAT change to str-only
+	'incremental_reload': bool,
+	'journal_copies': bool,
+	'loader_threads': int,
 	'max_console_history_size': (int, type(None)),
 	'max_history_size': (int, type(None)),
 	'mouse_enabled': bool,
 	'padding_right': bool,
+	'persistent_preview_cache': bool,
+	'persistent_preview_cache_size': int,
+	'preserve_hardlinks': bool,
+	'preview_cache_size': int,
+	'preview_delay': int,
+	'preview_prefetch': int,
 	'preview_directories': bool,
 	'preview_files': bool,
 	'preview_script': (str, type(None)),
+	'preview_worker': bool,
+	'reflink': str,
 	'save_console_history': bool,
 	'scroll_offset': int,
 	'shorten_title': int,  # XXX Note: False is an instance of int
@@ -41,7 +56,9 @@ ALLOWED_SETTINGS = {
 	'tilde_in_titlebar': bool,
 	'unicode_ellipsis': bool,
 	'update_title': bool,
+	'use_inotify': bool,
 	'use_preview_script': bool,
+	'verify_copies': bool,
 	'xterm_alt_key': bool,
 }
 
@@ -50,6 +67,7 @@ DEFAULT_VALUES = {
 	type(None): None,
 	str: "",
 	int: 0,
+	float: 0.0,
 	list: [],
 	tuple: tuple([]),
 }
@@ -4,12 +4,12 @@
 import codecs
 import os
 import re
-import shutil
 import string
 import tempfile
 from os.path import join, isdir, realpath, exists
 from os import link, symlink, getcwd, listdir, stat
 from inspect import cleandoc
+from time import time
 
 import ranger
 from ranger.ext.direction import Direction
@@ -22,10 +22,14 @@ from ranger.core.shared import FileManagerAware, EnvironmentAware, \
 		SettingsAware
 from ranger.core.tab import Tab
 from ranger.fsobject import File
-from ranger.core.loader import CommandLoader, CopyLoader
+from ranger.core.loader import CommandLoader, CopyLoader, DeleteLoader, \
+		PreviewLoader, RenameLoader, PRIORITY_PREVIEW, PRIORITY_PREFETCH, PRIORITY_STALE
+from ranger.ext.copy_journal import CopyJournal
+from ranger.ext.rename_plan import plan_renames
 from ranger.container.settingobject import ALLOWED_SETTINGS
 
 MACRO_FAIL = "<\x01\x01MACRO_HAS_NO_VALUE\x01\01>"
+MAX_PREFETCHES = 2  # previews which are prefetched at the same time
 
 class _MacroTemplate(string.Template):
 	"""A template for substituting macros in commands"""
@@ -44,7 +48,7 @@ class Actions(FileManagerAware, EnvironmentAware, SettingsAware):
 		"""Reset the filemanager, clearing the directory buffer"""
 		old_path = self.thisdir.path
 		self.restorable_tabs = {}
-		self.previews = {}
+		self.previews.clear()
 		self.garbage_collect(-1)
 		self.enter_dir(old_path)
 		self.change_mode('normal')
@@ -91,6 +95,11 @@ class Actions(FileManagerAware, EnvironmentAware, SettingsAware):
 				return int(value)
 			except ValueError:
 				pass
+		if float in types:
+			try:
+				return float(value)
+			except ValueError:
+				pass
 		if str in types:
 			return value
 		if list in types:
@@ -126,13 +135,13 @@ class Actions(FileManagerAware, EnvironmentAware, SettingsAware):
 			print(text)
 
 	def abort(self):
-		try:
-			item = self.loader.queue[0]
-		except:
-			self.notify("Type Q or :quit<Enter> to exit ranger")
+		for index, item in enumerate(self.loader.queue):
+			if not item.silent:
+				self.notify("Aborting: " + item.get_description())
+				self.loader.remove(index=index)
+				break
 		else:
-			self.notify("Aborting: " + item.get_description())
-			self.loader.remove(index=0)
+			self.notify("Type Q or :quit<Enter> to exit ranger")
 
 	def get_cumulative_size(self):
 		for f in self.thistab.get_selection() or ():
@@ -787,82 +796,225 @@ class Actions(FileManagerAware, EnvironmentAware, SettingsAware):
 		except:
 			return False
 
+	def redraw_later(self, seconds):
+		"""Redraw the browser after that many seconds, unless it's earlier"""
+		when = time() + seconds
+		if self.redraw_time is None or when < self.redraw_time:
+			self.redraw_time = when
+
 	def get_preview(self, path, width, height):
 		if self.settings.preview_script and self.settings.use_preview_script:
-			# self.previews is a 2 dimensional dict:
-			# self.previews['/tmp/foo.jpg'][(80, 24)] = "the content..."
-			# self.previews['/tmp/foo.jpg']['loading'] = False
-			# A -1 in tuples means "any"; (80, -1) = wid. of 80 and any hei.
-			# The key 'foundpreview' is added later. Values in (True, False)
+			# See ranger.container.preview_cache for the format of the data.
 			# XXX: Previews can break when collapse_preview is on and the
 			# preview column is popping out as you move the cursor on e.g. a
 			# PDF file.
-			try:
-				data = self.previews[path]
-			except:
-				data = self.previews[path] = {'loading': False}
-			else:
-				if data['loading']:
-					return None
+			data = self.previews.use(path)
+			if data['loading']:
+				return None
 
-			found = data.get((-1, -1), data.get((width, -1),
-				data.get((-1, height), data.get((width, height), False))))
+			# Wait until the cursor rests on the file, rather than starting
+			# the script for every file it passes over
+			now = time()
+			if self.preview_wait is None or self.preview_wait[0] != path:
+				self.preview_wait = (path,
+						now + self.settings.preview_delay / 1000.0)
+				self.preview_counted = None
+				# The neighbours of the previous file aren't wanted anymore
+				self._drop_prefetches(keep=path)
+			resting = now >= self.preview_wait[1]
+			if not resting:
+				self.redraw_later(self.preview_wait[1] - now)
+
+			if not resting:
+				# Show what's in the memory already, but leave the misses
+				# and the disk for when the cursor rests
+				found = self.previews.find(path, width, height, count=False)
+				return None if found == False else found
+			# Count the lookup once per rest, not on every redraw
+			count = self.preview_counted != path
+			self.preview_counted = path
+			found = self._find_preview(path, width, height, data, count)
 			if found == False:
-				data['loading'] = True
-				loadable = CommandLoader(args=[self.settings.preview_script,
-					path, str(width), str(height)], read=True,
-					silent=True, descr="Getting preview of %s" % path)
-				def on_after(signal):
-					exit = signal.process.poll()
-					content = signal.loader.stdout_buffer
-					data['foundpreview'] = True
-					if exit == 0:
-						data[(width, height)] = content
-					elif exit == 3:
-						data[(-1, height)] = content
-					elif exit == 4:
-						data[(width, -1)] = content
-					elif exit == 5:
-						data[(-1, -1)] = content
-					elif exit == 1:
-						data[(-1, -1)] = None
-						data['foundpreview'] = False
-					elif exit == 2:
-						f = codecs.open(path, 'r', errors='ignore')
-						try:
-							data[(-1, -1)] = f.read(1024 * 32)
-						except UnicodeDecodeError:
-							f.close()
-							f = codecs.open(path, 'r', encoding='latin-1',
-									errors='ignore')
-							data[(-1, -1)] = f.read(1024 * 32)
-						f.close()
-					else:
-						data[(-1, -1)] = None
-					if self.thisfile.realpath == path:
-						self.ui.browser.need_redraw = True
-					data['loading'] = False
-					pager = self.ui.browser.pager
-					if self.thisfile and self.thisfile.is_file:
-						pager.set_source(self.thisfile.get_preview_source(
-							pager.wid, pager.hei))
-				def on_destroy(signal):
-					try:
-						del self.previews[path]
-					except:
-						pass
-				loadable.signal_bind('after', on_after)
-				loadable.signal_bind('destroy', on_destroy)
-				self.loader.add(loadable)
+				self._generate_preview(path, width, height, data)
 				return None
-			else:
-				return found
+			if self.settings.preview_prefetch > 0:
+				self.prefetch_previews(path, width, height)
+			return found
 		else:
 			try:
 				return codecs.open(path, 'r', errors='ignore')
 			except:
 				return None
 
+	def _find_preview(self, path, width, height, data, count=True):
+		"""The cached preview, see PreviewCache.find()"""
+		found = self.previews.find(path, width, height, count)
+		if found == False and self.settings.persistent_preview_cache \
+				and self.persistent_previews:
+			try:
+				st = os.stat(path)
+			except OSError:
+				return found
+			cached = self.persistent_previews.load(path, st, width, height)
+			if cached is not None:
+				key, data['foundpreview'], found = cached
+				self.previews.store(path, data, key, found)
+		return found
+
+	def _generate_preview(self, path, width, height, data, prefetch=False,
+			use_worker=True):
+		"""Run the preview script with a PreviewLoader or CommandLoader"""
+		persistent = self.settings.persistent_preview_cache \
+				and self.persistent_previews
+		if persistent:
+			try:
+				st = os.stat(path)
+			except OSError:
+				persistent = None
+
+		data['loading'] = True
+		worker = None
+		if use_worker and self.settings.preview_worker \
+				and '\n' not in path:
+			worker = self.preview_workers.acquire(self.settings.preview_script)
+		if worker is not None:
+			loadable = PreviewLoader(self.preview_workers, worker, path,
+				width, height, descr="Getting preview of %s" % path)
+		else:
+			loadable = CommandLoader(args=[self.settings.preview_script,
+				path, str(width), str(height)], read=True,
+				silent=True, descr="Getting preview of %s" % path)
+		def get_priority():
+			if self.thisfile and self.thisfile.realpath == path:
+				return PRIORITY_PREVIEW
+			if prefetch and path in self.prefetch_paths:
+				return PRIORITY_PREFETCH
+			return PRIORITY_STALE
+		loadable.get_priority = get_priority
+		# Kill the script once the cursor has moved on
+		loadable.cancel_when_stale = True
+		def on_after(signal):
+			exit = signal.exit
+			if exit is None and worker is not None:
+				# The worker died before it finished, which says nothing
+				# about the file, so run the script directly this time
+				self._generate_preview(path, width, height, data,
+						prefetch, use_worker=False)
+				return
+			content = signal.loader.stdout_buffer
+			data['foundpreview'] = True
+			if exit == 0:
+				key = (width, height)
+			elif exit == 3:
+				key = (-1, height)
+			elif exit == 4:
+				key = (width, -1)
+			else:
+				key = (-1, -1)
+			if exit == 1:
+				content = None
+				data['foundpreview'] = False
+			elif exit == 2:
+				f = codecs.open(path, 'r', errors='ignore')
+				try:
+					content = f.read(1024 * 32)
+				except UnicodeDecodeError:
+					f.close()
+					f = codecs.open(path, 'r', encoding='latin-1',
+							errors='ignore')
+					content = f.read(1024 * 32)
+				f.close()
+			elif exit not in (0, 3, 4, 5):
+				content = None
+			self.previews.store(path, data, key, content)
+			if persistent and exit != 2:
+				persistent.save(path, st, key, data['foundpreview'], content)
+			data['loading'] = False
+			if prefetch:
+				self.prefetches.pop(path, None)
+				self._start_prefetches(width, height)
+			if self.thisfile and self.thisfile.realpath == path:
+				self.ui.browser.need_redraw = True
+				pager = self.ui.browser.pager
+				if self.thisfile.is_file:
+					pager.set_source(self.thisfile.get_preview_source(
+						pager.wid, pager.hei))
+		def on_destroy(signal):
+			if prefetch:
+				self.prefetches.pop(path, None)
+			try:
+				del self.previews[path]
+			except:
+				pass
+		loadable.signal_bind('after', on_after)
+		loadable.signal_bind('destroy', on_destroy)
+		if prefetch:
+			self.prefetches[path] = loadable
+		self.loader.add(loadable)
+
+	def prefetch_previews(self, path, width, height):
+		"""
+		Generate the previews of the next files in the direction in which
+		the cursor moves, while it rests on the file at path.  The setting
+		preview_prefetch says how many.  As soon as the cursor moves to
+		another file, get_preview() drops the prefetches.
+		"""
+		directory = self.thisdir
+		if self.prefetch_origin == path:
+			self._start_prefetches(width, height)
+			return
+		if directory is None or not directory.files \
+				or directory.pointer is None:
+			return
+
+		direction = 1
+		if self.prefetch_pointer is not None \
+				and self.prefetch_pointer[0] is directory \
+				and directory.pointer < self.prefetch_pointer[1]:
+			direction = -1
+		self.prefetch_origin = path
+		self.prefetch_pointer = (directory, directory.pointer)
+
+		files = directory.files
+		self.prefetch_queue = []
+		index = directory.pointer
+		for _ in range(self.settings.preview_prefetch):
+			index += direction
+			if index < 0 or index >= len(files):
+				break
+			fobj = files[index]
+			if fobj.is_file and fobj.has_preview():
+				self.prefetch_queue.append(fobj.realpath)
+		self.prefetch_paths = set(self.prefetch_queue)
+		self._start_prefetches(width, height)
+
+	def _drop_prefetches(self, keep=None):
+		"""
+		Forget the files to prefetch and remove the prefetches from the
+		loader, except the one of the path keep, which is needed now.
+		"""
+		self.prefetch_queue = []
+		self.prefetch_paths = set()
+		self.prefetch_origin = None
+		for path, loadable in list(self.prefetches.items()):
+			if path != keep:
+				self.loader.remove(item=loadable)
+				self.prefetches.pop(path, None)
+
+	def _start_prefetches(self, width, height):
+		running = len([path for path in self.prefetches
+				if path in self.prefetch_paths])
+		while self.prefetch_queue and running < MAX_PREFETCHES:
+			path = self.prefetch_queue.pop(0)
+			if path not in self.prefetch_paths:
+				continue
+			data = self.previews.use(path)
+			if data['loading'] or \
+					self._find_preview(path, width, height, data) != False:
+				continue
+			self._generate_preview(path, width, height, data, prefetch=True)
+			running += 1
+
 	# --------------------------
 	# -- Tabs
 	# --------------------------
@@ -1091,28 +1243,49 @@ class Actions(FileManagerAware, EnvironmentAware, SettingsAware):
 				link(source_path,
 					next_available_filename(target_path))
 
-	def paste(self, overwrite=False):
-		"""Paste the selected items into the current directory"""
-		self.loader.add(CopyLoader(self.copy_buffer, self.do_cut, overwrite))
+	def paste(self, overwrite=False, bandwidth=None, verify=None):
+		"""
+		Paste the selected items into the current directory.  The bandwidth
+		in MB/s defaults to the setting copy_bandwidth.  With verify, the
+		copies are compared with checksums of the originals afterwards,
+		which defaults to the setting verify_copies.
+		"""
+		self.loader.add(CopyLoader(self.copy_buffer, self.do_cut, overwrite,
+				bandwidth=bandwidth, verify=verify))
 		self.do_cut = False
 
+	def resume_copies(self, discard=False):
+		"""
+		Resume the copy jobs whose journals are left in confdir/copy_jobs,
+		or delete the journals if discard is true.  Returns their number.
+		"""
+		if ranger.arg.clean:
+			return 0
+		count = 0
+		for path in CopyJournal.find(self.confpath('copy_jobs')):
+			try:
+				journal = CopyJournal(path)
+			except IOError:
+				continue  # just resumed by another instance of ranger
+			info = journal.info
+			if discard or 'sources' not in info:
+				journal.remove()
+				continue
+			count += 1
+			# A set like the copy_buffer, which a cut job clears
+			files = set(File(source) for source in info['sources'])
+			self.loader.add(CopyLoader(files, info['cut'], info['overwrite'],
+					target=info['target'], journal=journal,
+					verify=info.get('verify')))
+		return count
+
 	def delete(self):
 		# XXX: warn when deleting mount points/unseen marked files?
 		self.notify("Deleting!")
 		selected = self.thistab.get_selection()
 		self.copy_buffer -= set(selected)
 		if selected:
-			for f in selected:
-				if isdir(f.path) and not os.path.islink(f.path):
-					try:
-						shutil.rmtree(f.path)
-					except OSError as err:
-						self.notify(err)
-				else:
-					try:
-						os.remove(f.path)
-					except OSError as err:
-						self.notify(err)
+			self.loader.add(DeleteLoader(selected))
 		self.thistab.ensure_correct_pointer()
 
 	def mkdir(self, name):
@@ -1129,3 +1302,16 @@ class Actions(FileManagerAware, EnvironmentAware, SettingsAware):
 			os.renames(src, dest)
 		except OSError as err:
 			self.notify(err)
+
+	def rename_files(self, renames):
+		"""
+		Rename many files at once, given as (old path, new path) tuples.
+		They are done in an order which allows e.g. swapping two names.
+		"""
+		try:
+			plan = plan_renames(renames)
+		except ValueError as err:
+			self.notify(err, bad=True)
+			return
+		if plan:
+			self.loader.add(RenameLoader(renames, plan))
@@ -10,6 +10,8 @@ from collections import deque
 import mimetypes
 import os.path
 import pwd
+import select
+import signal
 import socket
 import stat
 import sys
@@ -20,13 +22,19 @@ from ranger.core.tab import Tab
 from ranger.container.tags import Tags
 from ranger.gui.ui import UI
 from ranger.container.bookmarks import Bookmarks
+from ranger.container.preview_cache import PreviewCache, \
+		PersistentPreviewCache
 from ranger.core.runner import Runner
 from ranger.ext.get_executables import get_executables
 from ranger.ext.rifle import Rifle
 from ranger.fsobject import Directory
 from ranger.ext.signals import SignalDispatcher
+from ranger.ext.wakeup_pipe import WakeupPipe
+from ranger.ext.copy_journal import CopyJournal
+from ranger.ext.scope_worker import ScopeWorkerPool
 from ranger import __version__
 from ranger.core.loader import Loader
+from ranger.core.watcher import Watcher
 
 class FM(Actions, SignalDispatcher):
 	input_blocked = False
@@ -56,8 +64,20 @@ class FM(Actions, SignalDispatcher):
 		self.tags = tags
 		self.restorable_tabs = deque([], ranger.MAX_RESTORABLE_TABS)
 		self.py3 = sys.version_info >= (3, )
-		self.previews = {}
+		self.previews = PreviewCache()
+		self.persistent_previews = None
+		self.preview_workers = ScopeWorkerPool()
+		self.preview_wait = None  # (path, the time to generate its preview)
+		self.preview_counted = None  # the path of the last counted lookup
+		self.redraw_time = None   # see redraw_later()
+		# See prefetch_previews()
+		self.prefetches = {}          # path => CommandLoader
+		self.prefetch_queue = []      # the paths to prefetch next
+		self.prefetch_paths = set()   # the paths which are still wanted
+		self.prefetch_origin = None   # the path of the file at the cursor
+		self.prefetch_pointer = None  # (directory, pointer) at that time
 		self.loader = Loader()
+		self.watcher = Watcher()
 		self.copy_buffer = set()
 		self.do_cut = False
 
@@ -110,6 +130,10 @@ class FM(Actions, SignalDispatcher):
 		if not ranger.arg.clean and self.tags is None:
 			self.tags = Tags(self.confpath('tagged'))
 
+		if not ranger.arg.clean:
+			self.persistent_previews = PersistentPreviewCache(
+					self.confpath('previews'))
+
 		self.ui.setup_curses()
 		self.ui.initialize()
 
@@ -123,6 +147,13 @@ class FM(Actions, SignalDispatcher):
 			self.notify(text, bad=True)
 		self.run = Runner(ui=self.ui, logfunc=mylogfunc, fm=self)
 
+		if not ranger.arg.clean:
+			jobs = len(CopyJournal.find(self.confpath('copy_jobs')))
+			if jobs:
+				self.notify("%d copy job(s) were interrupted.  Type "
+						":resume_copy to continue or :resume_copy discard "
+						"to forget them." % jobs)
+
 	def destroy(self):
 		debug = ranger.arg.debug
 		if self.ui:
@@ -137,6 +168,18 @@ class FM(Actions, SignalDispatcher):
 			except:
 				if debug:
 					raise
+		if self.watcher:
+			try:
+				self.watcher.destroy()
+			except:
+				if debug:
+					raise
+		if self.preview_workers:
+			try:
+				self.preview_workers.shutdown()
+			except:
+				if debug:
+					raise
 
 	def _get_thisfile(self):
 		return self.thistab.thisfile
@@ -229,9 +272,12 @@ class FM(Actions, SignalDispatcher):
 		The main loop consists of:
 		1. reloading bookmarks if outdated
 		2. letting the loader work
-		3. drawing and finalizing ui
-		4. reading and handling user input
-		5. after X loops: collecting unused directory objects
+		3. watching the visible directories for changes
+		4. drawing and finalizing ui, if anything happened or the next
+		   frame is due
+		5. waiting for input, the loader, the watcher or a signal
+		6. reading and handling user input
+		7. after X loops: collecting unused directory objects
 		"""
 
 		self.enter_dir(self.thistab.path)
@@ -242,25 +288,73 @@ class FM(Actions, SignalDispatcher):
 		ui = self.ui
 		throbber = ui.throbber
 		loader = self.loader
+		watcher = self.watcher
 		has_throbber = hasattr(ui, 'throbber')
 		zombies = self.run.zombies
 
+		# Signal handlers (like the one for ^C) write into this pipe,
+		# otherwise select() would just continue waiting after them
+		signals = WakeupPipe()
+		try:
+			old_wakeup_fd = signal.set_wakeup_fd(signals.write_fd)
+		except (ValueError, AttributeError):
+			old_wakeup_fd = None
+		stdin = sys.stdin.fileno()
+
 		ranger.api.hook_ready(self)
 
+		event = True
+		had_work = False
+		next_frame = 0
+
 		try:
 			while True:
 				loader.work()
+				has_work = loader.has_work()
 				if has_throbber:
-					if loader.has_work():
+					if has_work:
 						throbber(loader.status)
 					else:
 						throbber(remove=True)
 
-				ui.redraw()
-
-				ui.set_load_mode(not loader.paused and loader.has_work())
-
-				ui.handle_input()
+				watcher.update()
+				if watcher.process_events():
+					event = True
+
+				now = time()
+				if self.redraw_time is not None and now >= self.redraw_time:
+					self.redraw_time = None
+					ui.browser.need_redraw = True
+					event = True
+				if event or has_work != had_work or now >= next_frame:
+					ui.redraw()
+					busy = has_work and not loader.paused
+					next_frame = now + (busy and ranger.FRAME_INTERVAL
+							or ranger.IDLE_INTERVAL)
+				had_work = has_work
+
+				if event or loader.can_work():
+					timeout = 0
+				elif self.redraw_time is not None:
+					timeout = max(0, min(next_frame, self.redraw_time) - time())
+				else:
+					timeout = max(0, next_frame - time())
+				fds = [stdin, signals, loader]
+				if watcher.fileno() >= 0:
+					fds.append(watcher)
+				try:
+					ready = select.select(fds, [], [], timeout)[0]
+				except select.error:
+					ready = [signals]  # interrupted by a signal
+				event = False
+				if signals in ready:
+					signals.clear()
+					event = True
+				if watcher in ready:
+					event = True
+
+				if ui.handle_input():
+					event = True
 
 				if zombies:
 					for zombie in tuple(zombies):
@@ -282,5 +376,8 @@ class FM(Actions, SignalDispatcher):
 				# XXX: UnicodeEncodeError: 'utf-8' codec can't encode character
 				# '\udcf6' in position 42: surrogates not allowed
 				open(ranger.arg.choosedir, 'w').write(self.thisdir.path)
+			if old_wakeup_fd is not None:
+				signal.set_wakeup_fd(old_wakeup_fd)
+			signals.close()
 			self.bookmarks.remember(self.thisdir)
 			self.bookmarks.save()
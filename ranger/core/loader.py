@@ -6,19 +6,267 @@ from time import time, sleep
 from subprocess import Popen, PIPE
 from ranger.core.shared import FileManagerAware
 from ranger.ext.signals import SignalDispatcher
-import math
+from ranger.ext.worker_pool import WorkerPool
+from ranger.ext.wakeup_pipe import WakeupPipe
+from ranger.ext.human_readable import human_readable, human_readable_time
+from ranger.ext import shutil_generatorized as shutil_g
+from ranger.ext.copy_journal import CopyJournal
+from ranger.ext.throttle import Throttle
+from ranger.ext.checksums import Checksums
+from ranger.ext import ioprio
+try:
+	from os import scandir
+except ImportError:
+	scandir = None
 import os.path
 import sys
+import ranger
+import stat
 import select
+import signal
+try:
+	from queue import Queue, Empty
+except ImportError:
+	from Queue import Queue, Empty
 try:
 	import chardet
 	HAVE_CHARDET = True
 except:
 	HAVE_CHARDET = False
 
+# Priorities of Loadables; lower values are loaded first
+PRIORITY_URGENT = 0      # moved to the top in the taskview
+PRIORITY_CURRENT = 1     # the current directory
+PRIORITY_PARENT = 2      # the parent directories
+PRIORITY_PREVIEW = 3     # the preview column
+PRIORITY_BACKGROUND = 4  # copying, commands, ...
+PRIORITY_PREFETCH = 5    # previews which may be needed soon
+PRIORITY_STALE = 6       # not visible anymore
+
+MEGABYTE = 1024 * 1024
+
+
+def devices_of(paths):
+	"""The set of st_dev of the paths.  Use it in a BlockingCall."""
+	devices = set()
+	for path in paths:
+		try:
+			st = os.stat(path)
+		except OSError:
+			try:
+				st = os.lstat(path)
+			except OSError:
+				continue
+		devices.add(st.st_dev)
+	return devices
+
+
+class BlockingCall(object):
+	"""
+	A function call which may block, like a stat() on a hung NFS mount.
+
+	Yield an instance of this from a load_generator and the Loader runs the
+	function in a worker thread while the UI stays responsive.  Once it's
+	done, the return value is sent back into the generator, or the
+	exception which the function raised is thrown into it:
+
+	    entries = yield BlockingCall(os.listdir, path)
+
+	The function must not touch anything which the main thread uses.
+	"""
+	item = None
+	result = None
+	exc_info = None
+	done = False
+	cancelled = False  # the item was removed while this was running
+
+	def __init__(self, function, *args, **keywords):
+		self.function = function
+		self.args = args
+		self.keywords = keywords
+
+	def run(self):
+		try:
+			self.result = self.function(*self.args, **self.keywords)
+		except Exception:
+			self.exc_info = sys.exc_info()
+
+
+class WaitingCall(BlockingCall):
+	"""
+	A BlockingCall which mostly waits, e.g. for the output of a process.
+	The Loader runs these in a pool of threads of their own, so they
+	don't hold up the loading of directories.
+
+	>>> from threading import Event
+	>>> from ranger.ext.openstruct import OpenStruct
+	>>> loader = Loader()
+	>>> loader.fm = OpenStruct(settings=OpenStruct(loader_threads=1))
+	>>> busy = Event()  # keeps the only loader thread busy
+	>>> blocker = BlockingCall(busy.wait, 5)
+	>>> loader._get_pool().submit(blocker)
+	>>> def generate():
+	... 	yield WaitingCall(sum, [1, 2])
+	>>> item = Loadable(generate(), 'waiting')
+	>>> loader._resume(item)
+	False
+	>>> select.select([loader], [], [], 5)[0] == [loader]
+	True
+	>>> loader._collect_completed()
+	>>> item.load_job.done, item.load_job.result
+	(True, 3)
+	>>> blocker.done
+	False
+	>>> busy.set()
+	>>> _ = select.select([loader], [], [], 5)
+	>>> loader.destroy()
+	"""
+
+
+def advance(generator, seconds):
+	"""
+	Run the generator for about the given time.  Returns a tuple of the
+	sum of the numbers it yielded and whether the generator is exhausted.
+
+	Use this with a BlockingCall to run plain generators, like the ones in
+	shutil_generatorized, in a worker thread one time slice after another.
+	"""
+	progress = 0
+	end_time = time() + seconds
+	try:
+		while True:
+			progress += next(generator) or 0
+			if time() >= end_time:
+				return progress, False
+	except StopIteration:
+		return progress, True
+
+
+def exhaust(generator):
+	"""
+	Run a load_generator to its end right here, in the calling thread,
+	doing the BlockingCalls which it yields directly.
+	"""
+	job = None
+	try:
+		while True:
+			if job is None:
+				result = next(generator)
+			elif job.exc_info:
+				result = generator.throw(*job.exc_info)
+			else:
+				result = generator.send(job.result)
+			if isinstance(result, BlockingCall):
+				job = result
+				job.run()
+			else:
+				job = None
+	except StopIteration:
+		pass
+
+
+class LoadStats(object):
+	"""
+	Statistics about the progress of a Loadable.  The rates and the ETA
+	are measured over a sliding window of the last few seconds.
+
+	Loadables which know how many bytes or files they have processed
+	report them with update(), the Loader adds the percentage.
+	"""
+	window = 5.0
+
+	def __init__(self):
+		self.start_time = time()
+		self.bytes = 0
+		self.files = 0
+		self.percent = 0
+		self.total_bytes = None
+		self.samples = deque()  # (time, bytes, files, percent)
+
+	def update(self, bytes=None, files=None, percent=None, total_bytes=None):
+		"""Record the current state.  Counts are totals, not increments"""
+		if bytes is not None:
+			self.bytes = bytes
+		if files is not None:
+			self.files = files
+		if percent is not None:
+			self.percent = percent
+		if total_bytes is not None:
+			self.total_bytes = total_bytes
+		now = time()
+		samples = self.samples
+		samples.append((now, self.bytes, self.files, self.percent))
+		# keep one sample from before the window for the rates
+		while len(samples) > 2 and now - samples[1][0] > self.window:
+			samples.popleft()
+
+	def _rate(self, index):
+		if len(self.samples) < 2:
+			return 0.0
+		first, last = self.samples[0], self.samples[-1]
+		seconds = last[0] - first[0]
+		if seconds <= 0:
+			return 0.0
+		return (last[index] - first[index]) / seconds
+
+	@property
+	def elapsed(self):
+		return time() - self.start_time
+
+	@property
+	def bytes_per_second(self):
+		return self._rate(1)
+
+	@property
+	def files_per_second(self):
+		return self._rate(2)
+
+	@property
+	def eta(self):
+		"""The estimated seconds until completion, or None if unknown"""
+		rate = self.bytes_per_second
+		if self.total_bytes and rate > 0:
+			return max(0, self.total_bytes - self.bytes) / rate
+		rate = self._rate(3)
+		if rate > 0:
+			return max(0, 100 - self.percent) / rate
+		return None
+
+	def as_dict(self):
+		return dict(elapsed=self.elapsed, bytes=self.bytes, files=self.files,
+				percent=self.percent, total_bytes=self.total_bytes,
+				bytes_per_second=self.bytes_per_second,
+				files_per_second=self.files_per_second, eta=self.eta)
+
+	def summary(self):
+		"""A short text like "12.3 M/s, 0:05 elapsed, 0:20 left" """
+		parts = []
+		if self.bytes:
+			parts.append(human_readable(self.bytes_per_second, '') + '/s')
+		if self.files:
+			parts.append('%d files/s' % self.files_per_second)
+		parts.append(human_readable_time(self.elapsed) + ' elapsed')
+		eta = self.eta
+		if eta is not None:
+			parts.append(human_readable_time(eta) + ' left')
+		return ', '.join(parts)
+
+
 class Loadable(object):
 	paused = False
 	progressbar_supported = False
+	load_job = None
+	stats = None  # a LoadStats, set by the Loader
+	priority = PRIORITY_BACKGROUND
+	priority_override = None  # set by moving the item in the taskview
+	load_priority = PRIORITY_BACKGROUND  # the one used by the Loader
+	last_serviced = 0
+	cancel_when_stale = False
+	# The st_dev of the disks which a file operation uses.  None means that
+	# they aren't known yet, an empty set that it doesn't use any.
+	devices = frozenset()
+	started = 0  # the order in which the Loader started the items
+	silent = False  # if True, it's left out of the taskview
 	def __init__(self, gen, descr):
 		self.load_generator = gen
 		self.description = descr
@@ -27,6 +275,16 @@ class Loadable(object):
 	def get_description(self):
 		return self.description
 
+	def get_stats(self):
+		"""A dict of statistics, see LoadStats.as_dict()"""
+		if self.stats is None:
+			return None
+		return self.stats.as_dict()
+
+	def get_priority(self):
+		"""Returns one of the PRIORITY_* constants.  Override this"""
+		return self.priority
+
 	def pause(self):
 		self.paused = True
 
@@ -41,74 +299,623 @@ class Loadable(object):
 
 
 class CopyLoader(Loadable, FileManagerAware):
+	"""
+	Copy or move files into a directory, by default the current one.
+
+	Unless the setting journal_copies is off, the progress is recorded in
+	a CopyJournal, so the job can be resumed by passing that journal.
+
+	The bandwidth in MB/s (0 is unlimited) defaults to the setting
+	copy_bandwidth and can be changed later with set_bandwidth().
+
+	With verify, which defaults to the setting verify_copies, the copies
+	are read back and compared with the checksums of the data which were
+	computed while copying.
+	"""
 	progressbar_supported = True
-	def __init__(self, copy_buffer, do_cut=False, overwrite=False):
+	def __init__(self, copy_buffer, do_cut=False, overwrite=False,
+			target=None, journal=None, bandwidth=None, verify=None):
 		self.copy_buffer = tuple(copy_buffer)
 		self.do_cut = do_cut
 		self.original_copy_buffer = copy_buffer
-		self.original_path = self.fm.thistab.path
+		self.original_path = target or self.fm.thistab.path
 		self.overwrite = overwrite
+		self.journal = journal
+		self.reflink = self.fm.settings.reflink
+		self.threads = self.fm.settings.copy_threads
+		self.hardlinks = self.fm.settings.preserve_hardlinks
+		self.io_priority = self.fm.settings.copy_io_priority
+		if bandwidth is None:
+			bandwidth = self.fm.settings.copy_bandwidth
+		self.throttle = Throttle()
+		self.set_bandwidth(bandwidth)
+		self.control = shutil_g.CopyControl()
+		if verify is None:
+			verify = self.fm.settings.verify_copies
+		self.checksums = None
+		if verify:
+			algorithm = self.fm.settings.checksum_algorithm
+			try:
+				self.checksums = Checksums(algorithm)
+			except ValueError:
+				self.fm.notify("Unknown checksum algorithm: %s" % algorithm,
+						bad=True)
+		# The sources of a verified move are removed after verifying
+		self.removals = None
+		if self.checksums is not None and do_cut:
+			self.removals = []
+		self.cloned_files = 0
+		self.renames = set()
+		self.total_size = 0
+		self.copied_size = 0
+		self.copied_files = 0
 		self.percent = 0
 		if self.copy_buffer:
 			self.one_file = self.copy_buffer[0]
-		Loadable.__init__(self, self.generate(), 'Calculating size...')
-
-	def _calculate_size(self, step):
-		from os.path import join
-		size = 0
-		stack = [f.path for f in self.copy_buffer]
-		while stack:
-			fname = stack.pop()
-			if os.path.isdir(fname):
-				stack.extend([join(fname, item) for item in os.listdir(fname)])
-			else:
-				try:
-					fstat = os.stat(fname)
-				except:
-					continue
-				size += max(step, math.ceil(fstat.st_size / step) * step)
-		return size
+		self.devices = None  # found out by generate()
+		Loadable.__init__(self, self.generate(), 'Copying...')
+
+	def get_description(self):
+		if self.throttle.rate:
+			return "%s [max %s/s]" % (self.description,
+					human_readable(self.throttle.rate, ''))
+		return self.description
+
+	def get_bandwidth(self):
+		"""The limit in MB/s, or 0"""
+		return self.throttle.rate / float(MEGABYTE)
+
+	def set_bandwidth(self, bandwidth):
+		"""Limit the copying to that many MB/s, or not at all with 0"""
+		self.throttle.rate = int(bandwidth * MEGABYTE)
+
+	def _find_renames(self):
+		"""The paths which can be moved by renaming them"""
+		try:
+			device = os.stat(self.original_path).st_dev
+		except OSError:
+			return set()
+		renames = set()
+		for f in self.copy_buffer:
+			try:
+				if os.lstat(f.path).st_dev == device:
+					renames.add(f.path)
+			except OSError:
+				pass
+		return renames
+
+	def _create_journal(self, directory, info):
+		"""Returns the tuple (journal, error), runs in a worker thread"""
+		try:
+			return CopyJournal.create(directory, info), None
+		except (IOError, OSError) as err:
+			return None, err
 
 	def generate(self):
-		from ranger.ext import shutil_generatorized as shutil_g
-		if self.copy_buffer:
-			# TODO: Don't calculate size when renaming (needs detection)
-			bytes_per_tick = shutil_g.BLOCK_SIZE
-			size = max(1, self._calculate_size(bytes_per_tick))
-			bar_tick = 100.0 / (float(size) / bytes_per_tick)
+		if not self.copy_buffer:
+			self.devices = frozenset()
+			return
+		self.devices = yield BlockingCall(devices_of,
+				[f.path for f in self.copy_buffer] + [self.original_path])
+		if self.journal is None and not ranger.arg.clean \
+				and self.fm.settings.journal_copies:
+			info = dict(target=self.original_path, cut=self.do_cut,
+					overwrite=self.overwrite,
+					verify=self.checksums is not None,
+					sources=[f.path for f in self.copy_buffer])
+			self.journal, error = yield BlockingCall(self._create_journal,
+					self.fm.confpath('copy_jobs'), info)
+			if error is not None:
+				self.fm.notify("Cannot create a journal: %s" % error,
+						bad=True)
+		try:
 			if self.do_cut:
 				self.original_copy_buffer.clear()
 				if len(self.copy_buffer) == 1:
 					self.description = "moving: " + self.one_file.path
 				else:
 					self.description = "moving files from: " + self.one_file.dirname
-				for f in self.copy_buffer:
-					for _ in shutil_g.move(src=f.path,
-							dst=self.original_path,
-							overwrite=self.overwrite):
-						self.percent += bar_tick
-						yield
+				self.renames = yield BlockingCall(self._find_renames)
 			else:
 				if len(self.copy_buffer) == 1:
 					self.description = "copying: " + self.one_file.path
 				else:
 					self.description = "copying files from: " + self.one_file.dirname
-				for f in self.copy_buffer:
-					if os.path.isdir(f.path):
-						for _ in shutil_g.copytree(src=f.path,
-								dst=os.path.join(self.original_path, f.basename),
-								symlinks=True,
-								overwrite=self.overwrite):
-							self.percent += bar_tick
-							yield
+			if len(self.renames) == len(self.copy_buffer):
+				# Renaming doesn't depend on the size, so count files instead
+				self.total_size = len(self.copy_buffer)
+
+			# The copying itself only touches the filesystem, so it can
+			# run in a worker thread one time slice after another.  The
+			# total size grows while the trees are walked, so the progress
+			# becomes accurate once the walk is over.
+			operations = self._operations()
+			done = False
+			while not done:
+				copied, done = yield BlockingCall(self._work, operations)
+				self.copied_size += copied
+				self.percent = min(100.0,
+						100.0 * self.copied_size / max(1, self.total_size))
+				if len(self.renames) == len(self.copy_buffer):
+					self.stats.update(files=self.copied_files)
+				else:
+					self.stats.update(bytes=self.copied_size,
+							files=self.copied_files,
+							total_bytes=self.total_size)
+				if self.cloned_files and not self.description.endswith(')'):
+					self.description += " (reflinked)"
+			checksums = self.checksums
+			if checksums is not None and checksums.files:
+				# Read the copies back, with a progress bar and statistics
+				# of their own
+				copy_speed = self.stats.bytes / max(0.001, self.stats.elapsed)
+				self.description = "verifying: " + self.one_file.dirname
+				self.stats = LoadStats()
+				self.percent = 0
+				verified = 0
+				verification = checksums.verify()
+				done = False
+				while not done:
+					read, done = yield BlockingCall(self._work, verification)
+					verified += read
+					self.percent = min(100.0,
+							100.0 * verified / max(1, checksums.size))
+					self.stats.update(bytes=verified,
+							total_bytes=checksums.size)
+				self._report_verification(copy_speed)
+			if self.removals:
+				if checksums.mismatches:
+					self.fm.notify("Kept the sources of the move because "
+							"verifying failed", bad=True)
+				else:
+					self.description = "removing sources: " \
+							+ self.one_file.dirname
+					yield BlockingCall(self._remove_sources)
+		finally:
+			# A cancelled job keeps its journal, which destroy() closed,
+			# while one which ended, even with an error, is over
+			if self.journal is not None and not self.control.cancelled:
+				self.journal.remove()
+		cwd = self.fm.get_directory(self.original_path)
+		cwd.load_content()
+
+	def _report_verification(self, copy_speed):
+		"""Tell about the copies which differ, or the speed of both phases"""
+		checksums = self.checksums
+		for dst, reason in checksums.mismatches:
+			self.fm.notify("Verifying %s failed: %s" % (dst, reason),
+					bad=True)
+		if not checksums.mismatches:
+			verify_speed = self.stats.bytes / max(0.001, self.stats.elapsed)
+			self.fm.notify("Verified %d files: copied with %s/s, "
+					"verified with %s/s" % (len(checksums.files),
+					human_readable(copy_speed, ''),
+					human_readable(verify_speed, '')))
+
+	def _remove_sources(self):
+		"""Remove the sources of a move once the copies are verified"""
+		for path in self.removals:
+			if os.path.isdir(path) and not os.path.islink(path):
+				shutil_g.rmtree(path)
+			else:
+				os.unlink(path)
+		del self.removals[:]
+
+	def _work(self, operations):
+		"""Do a time slice of the copying with the I/O priority of the job.
+		The threads of copytree() are started here, so they inherit it."""
+		priority = ioprio.PRIORITIES.get(self.io_priority)
+		old = None
+		if priority is not None:
+			old = ioprio.set_priority(*priority)
+		try:
+			return advance(operations, self.fm.loader.seconds_of_work_time)
+		finally:
+			ioprio.restore_priority(old)
+
+	def _operations(self):
+		"""Yields the number of bytes after every chunk of copied data"""
+		for copied in self._copy_operations():
+			if isinstance(copied, shutil_g.Planned):
+				self.total_size += copied
+				yield 0
+				continue
+			if isinstance(copied, shutil_g.Finished):
+				self.copied_files += 1
+			elif isinstance(copied, shutil_g.Cloned):
+				self.cloned_files += 1
+			yield copied
+
+	def _copy_operations(self):
+		count_files = len(self.renames) == len(self.copy_buffer)
+		# copytree() with threads walks and copies at the same time
+		threads = max(1, self.threads)
+		for f in self.copy_buffer:
+			if f.path in self.renames:
+				# move() falls back to copying if renaming fails after
+				# all, but that can't be measured in bytes here
+				for _ in shutil_g.move(src=f.path,
+						dst=self.original_path,
+						overwrite=self.overwrite,
+						reflink=self.reflink,
+						threads=threads,
+						hardlinks=self.hardlinks,
+						throttle=self.throttle,
+						checksums=self.checksums,
+						control=self.control,
+						removals=self.removals):
+					yield 0
+				self.copied_files += 1
+				if count_files:
+					yield 1
+			elif self.journal is not None:
+				for copied in self._journaled_copy(f, threads):
+					yield copied
+			elif self.do_cut:
+				for copied in shutil_g.move(src=f.path,
+						dst=self.original_path,
+						overwrite=self.overwrite,
+						reflink=self.reflink,
+						threads=threads,
+						hardlinks=self.hardlinks,
+						throttle=self.throttle,
+						checksums=self.checksums,
+						control=self.control,
+						removals=self.removals):
+					yield copied
+			elif os.path.isdir(f.path):
+				for copied in shutil_g.copytree(src=f.path,
+						dst=os.path.join(self.original_path, f.basename),
+						symlinks=True,
+						overwrite=self.overwrite,
+						reflink=self.reflink,
+						threads=threads,
+						hardlinks=self.hardlinks,
+						throttle=self.throttle,
+						checksums=self.checksums,
+						control=self.control):
+					yield copied
+			else:
+				try:
+					st = os.lstat(f.path)
+				except OSError:
+					st = None
+				if st is not None and stat.S_ISLNK(st.st_mode):
+					st = None  # copied as a symlink
+				if st is not None:
+					yield shutil_g.Planned(shutil_g.allocated_size(st))
+				for copied in shutil_g.copy2(f.path, self.original_path,
+						symlinks=True,
+						overwrite=self.overwrite,
+						reflink=self.reflink,
+						src_stat=st,
+						throttle=self.throttle,
+						checksums=self.checksums):
+					yield copied
+				self.copied_files += 1
+
+	def _journaled_copy(self, f, threads):
+		"""Copy or move an item like the other operations, using the journal.
+		Items which were copied before the job was interrupted are skipped."""
+		journal = self.journal
+		overwrite = self.overwrite
+		try:
+			st = os.lstat(f.path)
+		except OSError:
+			if journal.resumed:
+				return  # it was moved before the interruption
+			raise
+		dst = journal.destinations.get(f.path)
+		if dst is None:
+			dst = os.path.join(self.original_path, f.basename)
+			if not overwrite:
+				dst = shutil_g.get_safe_path(dst)
+			journal.destination(f.path, dst)
+		else:
+			overwrite = True  # it's our own destination
+		# Like in _copy_operations, a link to a directory is copied deeply
+		if os.path.isdir(f.path):
+			for copied in shutil_g.copytree(src=f.path, dst=dst,
+					symlinks=True,
+					overwrite=overwrite,
+					reflink=self.reflink,
+					threads=threads,
+					journal=journal,
+					hardlinks=self.hardlinks,
+					throttle=self.throttle,
+					checksums=self.checksums,
+					control=self.control):
+				yield copied
+			if self.do_cut:
+				for _ in self._hash_sources(f.path):
+					yield 0
+				if self.removals is not None:
+					self.removals.append(f.path)
+				elif stat.S_ISLNK(st.st_mode):
+					os.unlink(f.path)
+				else:
+					shutil_g.rmtree(f.path)
+			return
+		if stat.S_ISLNK(st.st_mode):
+			st = None  # copied as a symlink
+		else:
+			yield shutil_g.Planned(shutil_g.allocated_size(st))
+		if st is not None or not os.path.lexists(dst):
+			for copied in shutil_g.copy2(f.path, dst,
+					symlinks=True,
+					overwrite=overwrite,
+					reflink=self.reflink,
+					src_stat=st,
+					journal=journal,
+					throttle=self.throttle,
+					checksums=self.checksums):
+				yield copied
+		self.copied_files += 1
+		if self.do_cut:
+			for _ in self._hash_sources(f.path):
+				yield 0
+			if self.removals is not None:
+				self.removals.append(f.path)
+			else:
+				os.unlink(f.path)
+
+	def _hash_sources(self, path):
+		"""
+		Files which were copied before the job was resumed have no
+		checksum of their source yet.  It's computed before the sources
+		are removed, so verifying doesn't need them anymore.
+		"""
+		if self.checksums is not None and self.journal.resumed:
+			for read in self.checksums.hash_sources(path):
+				yield read
+
+	def pause(self):
+		# Only the pause of the whole loader stops the threads.  The
+		# loader also pauses an item when it switches to another one,
+		# but copies on different devices are meant to run side by side.
+		if self.fm.loader.paused:
+			self.control.pause()
+		Loadable.pause(self)
+
+	def unpause(self):
+		self.control.unpause()
+		Loadable.unpause(self)
+
+	def destroy(self):
+		self.control.cancel()
+		if self.journal is not None:
+			self.journal.close()
+
+
+class DeleteLoader(Loadable, FileManagerAware):
+	"""
+	Delete files and directory trees.  The files of different directories
+	are removed by several threads at once.
+	"""
+	progressbar_supported = True
+	def __init__(self, files):
+		self.files = tuple(files)
+		self.threads = self.fm.settings.copy_threads
+		self.percent = 0
+		self.trees = []
+		self.total = 0
+		self.removed = 0
+		self.errors = []
+		self.devices = None  # found out by generate()
+		self.control = shutil_g.CopyControl()
+		Loadable.__init__(self, self.generate(), 'Deleting...')
+
+	def generate(self):
+		if not self.files:
+			self.devices = frozenset()
+			return
+		self.devices = yield BlockingCall(devices_of,
+				[f.path for f in self.files])
+		if len(self.files) == 1:
+			description = "deleting: " + self.files[0].path
+		else:
+			description = "deleting files from: " + self.files[0].dirname
+
+		# The total isn't known before the walk is over, so show what
+		# was found so far
+		seconds = self.fm.loader.seconds_of_work_time
+		done = False
+		walk = self._walk()
+		while not done:
+			self.description = "%s (%d found)" % (description, self.total)
+			_, done = yield BlockingCall(advance, walk, seconds)
+		self.description = description
+		bar_tick = 100.0 / max(1, self.total)
+
+		for path, directories in self.trees:
+			if self.control.cancelled:
+				break
+			done = False
+			removal = self._remove(path, directories)
+			while not done:
+				removed, done = yield WaitingCall(advance, removal, seconds)
+				self.removed += removed
+				self.percent = bar_tick * self.removed
+				self.stats.update(files=self.removed)
+			# Let the visible directory show the change right away
+			try:
+				parent = self.fm.directories[os.path.dirname(path)]
+			except KeyError:
+				pass
+			else:
+				parent.content_outdated = True
+
+		for err in self.errors:
+			self.fm.notify(err, bad=True)
+
+	def _walk(self):
+		"""
+		Find out what to delete.  For each of self.files, a tuple of its
+		path and a list of (directory, [names of non-directories]) in
+		pre-order is appended to self.trees.  Yields after each directory.
+		"""
+		for f in self.files:
+			path = f.path
+			directories = []
+			self.trees.append((path, directories))
+			if not os.path.isdir(path) or os.path.islink(path):
+				self.total += 1
+				continue
+			stack = [path]
+			while stack:
+				dirpath = stack.pop()
+				names = []
+				directories.append((dirpath, names))
+				try:
+					if scandir is not None:
+						for entry in scandir(dirpath):
+							if entry.is_dir(follow_symlinks=False):
+								stack.append(entry.path)
+							else:
+								names.append(entry.name)
 					else:
-						for _ in shutil_g.copy2(f.path, self.original_path,
-								symlinks=True,
-								overwrite=self.overwrite):
-							self.percent += bar_tick
-							yield
-			cwd = self.fm.get_directory(self.original_path)
-			cwd.load_content()
+						for name in os.listdir(dirpath):
+							fullname = os.path.join(dirpath, name)
+							if stat.S_ISDIR(os.lstat(fullname).st_mode):
+								stack.append(fullname)
+							else:
+								names.append(name)
+				except OSError as err:
+					self.errors.append(err)
+				# the names and the directory itself
+				self.total += len(names) + 1
+				yield
+
+	def _remove_files(self, dirpath, names):
+		removed = 0
+		errors = []
+		for name in names:
+			if not self.control.proceed():
+				break
+			try:
+				os.remove(os.path.join(dirpath, name))
+			except OSError as err:
+				errors.append(err)
+			removed += 1
+		return removed, errors
+
+	def _remove(self, path, directories):
+		"""Yields the number of removed entries every now and then"""
+		if not directories:
+			try:
+				os.remove(path)
+			except OSError as err:
+				self.errors.append(err)
+			yield 1
+			return
+
+		done = Queue()
+		pool = WorkerPool(max(1, self.threads), on_done=done.put)
+		self.control.pools.append(pool)
+		pending = 0
+		try:
+			for dirpath, names in directories:
+				if names:
+					pool.submit(BlockingCall(self._remove_files,
+						dirpath, names))
+					pending += 1
+			while pending and not self.control.cancelled:
+				try:
+					job = done.get(timeout=self.fm.loader.seconds_of_work_time)
+				except Empty:
+					yield 0
+					continue
+				pending -= 1
+				removed, errors = job.result
+				self.errors.extend(errors)
+				yield removed
+		finally:
+			# Stop deleting when this job is cancelled
+			pool.cancel()
+			pool.shutdown()
+			self.control.pools.remove(pool)
+
+		# Remove the directories, the deepest ones first
+		for dirpath, names in reversed(directories):
+			if self.control.cancelled:
+				return
+			try:
+				os.rmdir(dirpath)
+			except OSError as err:
+				self.errors.append(err)
+			yield 1
+
+	def pause(self):
+		# Like in CopyLoader, only the pause of the whole loader stops
+		# the threads, which keep deleting between time slices otherwise
+		if self.fm.loader.paused:
+			self.control.pause()
+		Loadable.pause(self)
+
+	def unpause(self):
+		self.control.unpause()
+		Loadable.unpause(self)
+
+	def destroy(self):
+		self.control.cancel()
+
+
+class RenameLoader(Loadable, FileManagerAware):
+	"""
+	Rename files in the order given by ranger.ext.rename_plan, then
+	update the listings of their directories in place.
+	"""
+	progressbar_supported = True
+	def __init__(self, renames, plan):
+		self.renames = dict(renames)
+		self.plan = plan
+		self.percent = 0
+		self.renamed = 0
+		self.error = None
+		Loadable.__init__(self, self.generate(), 'Renaming...')
+
+	def generate(self):
+		if not self.plan:
+			return
+		self.description = "renaming files in: " + \
+				os.path.dirname(self.plan[0][0])
+
+		seconds = self.fm.loader.seconds_of_work_time
+		bar_tick = 100.0 / len(self.plan)
+		done = False
+		work = self._rename()
+		while not done:
+			renamed, done = yield BlockingCall(advance, work, seconds)
+			self.renamed += renamed
+			self.percent = bar_tick * self.renamed
+			self.stats.update(files=self.renamed)
+
+		dirnames = set(os.path.dirname(path) for path in self.renames)
+		dirnames.update(os.path.dirname(path) for path in self.renames.values())
+		for dirname in dirnames:
+			try:
+				directory = self.fm.directories[dirname]
+			except KeyError:
+				continue
+			if self.error is not None:
+				directory.content_outdated = True
+			else:
+				directory.apply_renames(self.renames)
+
+		if self.error is not None:
+			self.fm.notify("Renaming stopped after %d of %d renames: %s" %
+					(self.renamed, len(self.plan), self.error), bad=True)
+		else:
+			self.fm.notify("Renamed %d files" % len(self.renames))
+
+	def _rename(self):
+		for src, dst in self.plan:
+			try:
+				os.rename(src, dst)
+			except OSError as err:
+				self.error = err
+				return
+			yield 1
 
 
 class CommandLoader(Loadable, SignalDispatcher, FileManagerAware):
@@ -136,8 +943,7 @@ class CommandLoader(Loadable, SignalDispatcher, FileManagerAware):
 		self.signal_emit('before', process=process, loader=self)
 		if self.silent and not self.read:
 			while process.poll() is None:
-				yield
-				sleep(0.03)
+				yield WaitingCall(sleep, self.fm.loader.get_wait_time())
 		else:
 			py3 = sys.version >= '3'
 			selectlist = []
@@ -146,38 +952,45 @@ class CommandLoader(Loadable, SignalDispatcher, FileManagerAware):
 			if not self.silent:
 				selectlist.append(process.stderr)
 			while process.poll() is None:
-				yield
-				try:
-					rd, _, __ = select.select(selectlist, [], [], 0.03)
-					if rd:
-						rd = rd[0]
-						if rd == process.stderr:
-							read = rd.readline()
-							if py3:
-								read = safeDecode(read)
-							if read:
-								self.fm.notify(read, bad=True)
-						elif rd == process.stdout:
-							read = rd.read(512)
-							if py3:
-								read = safeDecode(read)
-							if read:
-								self.stdout_buffer += read
-				except select.error:
-					sleep(0.03)
+				stream, read = yield WaitingCall(self._read_output,
+						selectlist, self.fm.loader.get_wait_time())
+				if py3 and read:
+					read = safeDecode(read)
+				if not read:
+					continue
+				if stream == process.stderr:
+					self.fm.notify(read, bad=True)
+				else:
+					self.stdout_buffer += read
 			if not self.silent:
-				for l in process.stderr.readlines():
+				lines = yield WaitingCall(process.stderr.readlines)
+				for l in lines:
 					if py3:
 						l = safeDecode(l)
 					self.fm.notify(l, bad=True)
 			if self.read:
-				read = process.stdout.read()
+				read = yield WaitingCall(process.stdout.read)
 				if py3:
 					read = safeDecode(read)
 				self.stdout_buffer += read
 		null.close()
 		self.finished = True
-		self.signal_emit('after', process=process, loader=self)
+		self.signal_emit('after', process=process, loader=self,
+				exit=process.poll())
+
+	def _read_output(self, selectlist, timeout):
+		"""Wait briefly for output of the process and read it"""
+		try:
+			rd, _, __ = select.select(selectlist, [], [], timeout)
+		except select.error:
+			sleep(timeout)
+			return None, None
+		if not rd:
+			return None, None
+		rd = rd[0]
+		if rd == self.process.stderr:
+			return rd, rd.readline()
+		return rd, rd.read(512)
 
 	def pause(self):
 		if not self.finished and not self.paused:
@@ -203,6 +1016,74 @@ class CommandLoader(Loadable, SignalDispatcher, FileManagerAware):
 			self.process.kill()
 
 
+class PreviewLoader(Loadable, SignalDispatcher, FileManagerAware):
+	"""
+	Get the output of the preview script from a ScopeWorker, which stays
+	around for the next preview.  The signals are like the ones of a
+	CommandLoader, with process set to None.
+	"""
+	finished = False
+	silent = True
+	receiving = False  # a receive() of the worker may run in a thread
+	def __init__(self, pool, worker, path, width, height, descr):
+		SignalDispatcher.__init__(self)
+		Loadable.__init__(self, self.generate(), descr)
+		self.pool = pool
+		self.worker = worker
+		self.path = path
+		self.width = width
+		self.height = height
+		self.stdout_buffer = ""
+
+	def generate(self):
+		worker = self.worker
+		self.signal_emit('before', process=None, loader=self)
+		try:
+			worker.request(self.path, self.width, self.height)
+		except OSError:
+			pass
+		else:
+			self.receiving = True
+			try:
+				while not (yield WaitingCall(worker.receive,
+						self.fm.loader.get_wait_time())):
+					pass
+			except GeneratorExit:
+				# The loader closes us once the receive() is over
+				worker.close()
+				raise
+			self.receiving = False
+		if worker.output:
+			if sys.version >= '3':
+				self.stdout_buffer = safeDecode(worker.output)
+			else:
+				self.stdout_buffer = worker.output
+		self.finished = True
+		self.pool.release(worker)
+		self.signal_emit('after', process=None, loader=self,
+				exit=worker.exit_code)
+
+	def pause(self):
+		if not self.finished and not self.paused:
+			self.worker.send_signal(signal.SIGSTOP)
+			Loadable.pause(self)
+
+	def unpause(self):
+		if not self.finished and self.paused:
+			self.worker.send_signal(signal.SIGCONT)
+			Loadable.unpause(self)
+
+	def destroy(self):
+		self.signal_emit('destroy', process=None, loader=self)
+		if not self.finished:
+			# Stop the script and whatever it started.  The pipes are
+			# closed by generate() if a thread may still read them.
+			if self.receiving:
+				self.worker.kill()
+			else:
+				self.worker.close()
+
+
 def safeDecode(string):
 	try:
 		return string.decode("utf-8")
@@ -215,6 +1096,22 @@ def safeDecode(string):
 
 class Loader(FileManagerAware):
 	seconds_of_work_time = 0.03
+	# How long a BlockingCall in a worker thread may wait for a process
+	seconds_of_waiting_time = 0.2
+	# The time an item may wait, after it has been worked on, before it is
+	# due again.  The item with the earliest such deadline goes next, so
+	# long background jobs still get some time while browsing.
+	max_wait_time = {
+		PRIORITY_URGENT: 0,
+		PRIORITY_CURRENT: 0,
+		PRIORITY_PARENT: 0.05,
+		PRIORITY_PREVIEW: 0.1,
+		PRIORITY_BACKGROUND: 0.3,
+		PRIORITY_PREFETCH: 1,
+		PRIORITY_STALE: 2,
+	}
+	# The threads for WaitingCalls, in addition to the loader_threads
+	waiting_threads = 8
 	throbber_chars = r'/-\|'
 	throbber_paused = '#'
 	paused = False
@@ -226,6 +1123,11 @@ class Loader(FileManagerAware):
 		self.throbber_status = 0
 		self.rotate()
 		self.old_item = None
+		self.starts = 0
+		self.pool = None
+		self.wait_pool = None
+		self.completed = Queue()
+		self.wakeup = WakeupPipe()  # readable when a worker is done
 
 	def rotate(self):
 		"""Rotate the throbber"""
@@ -241,6 +1143,10 @@ class Loader(FileManagerAware):
 		"""
 		while obj in self.queue:
 			self.queue.remove(obj)
+		obj.load_job = None  # belongs to an old load_generator, if any
+		obj.started = 0
+		obj.last_serviced = time()
+		obj.stats = LoadStats()
 		self.queue.appendleft(obj)
 		if self.paused:
 			obj.pause()
@@ -256,10 +1162,12 @@ class Loader(FileManagerAware):
 		del self.queue[_from]
 
 		if to == 0:
+			item.priority_override = item.load_priority = PRIORITY_URGENT
 			self.queue.appendleft(item)
 			if _from != 0:
 				self.queue[1].pause()
 		elif to == -1:
+			item.priority_override = item.load_priority = PRIORITY_STALE
 			self.queue.append(item)
 		else:
 			raise NotImplementedError
@@ -276,16 +1184,40 @@ class Loader(FileManagerAware):
 		if index is not None:
 			if item is None:
 				item = self.queue[index]
+			generator = item.load_generator
 			if hasattr(item, 'unload'):
 				item.unload()
 			item.destroy()
 			del self.queue[index]
+			if item is self.old_item:
+				self.old_item = None
+			if self.is_waiting(item):
+				# The worker still runs a part of it, which must finish
+				# before the generator can be closed
+				item.load_job.cancelled = True
+				item.load_job.generator = generator
+			else:
+				self._close(generator)
+			item.load_job = None
 			if item.progressbar_supported:
 				self.fm.ui.status.request_redraw()
 
+	def _close(self, generator):
+		"""Close the load_generator of a removed item, running its cleanup"""
+		if generator is None:
+			return
+		try:
+			generator.close()
+		except Exception as err:
+			self.fm.notify(err)
+
 	def pause(self, state):
 		"""
 		Change the pause-state to 1 (pause), 0 (no pause) or -1 (toggle)
+
+		Pausing takes effect between time slices: a BlockingCall which
+		already runs in a worker thread is finished first, unless the
+		pause() of the item stops it, like the one of a CommandLoader.
 		"""
 		if state == -1:
 			state = not self.paused
@@ -294,39 +1226,205 @@ class Loader(FileManagerAware):
 
 		self.paused = state
 
-		if not self.queue:
-			return
+		# Several items may be running at once in worker threads
+		for item in self.queue:
+			if state:
+				item.pause()
+			elif item is self.old_item or self.is_waiting(item):
+				item.unpause()
+
+	def is_waiting(self, item):
+		"""Is a BlockingCall of the item still running in a worker?"""
+		job = item.load_job
+		return job is not None and not job.done
+
+	def is_blocked(self, item):
+		"""
+		Does the item use a device which a file operation that was started
+		before is still using?  Those run one after another, while the
+		ones on different devices run at the same time.
+
+		An item whose devices are unknown may go on to find them out, but
+		the ones started after it wait until it knows them.
+		"""
+		if not item.devices:
+			return False
+		for other in self.queue:
+			if other is item or not other.started \
+					or (item.started and other.started > item.started):
+				continue
+			if other.devices is None or \
+					not other.devices.isdisjoint(item.devices):
+				return True
+		return False
+
+	def can_work(self):
+		"""Is there an item which doesn't have to wait for the workers?"""
+		if self.paused:
+			return False
+		for item in self.queue:
+			if not self.is_waiting(item) and not self.is_blocked(item):
+				return True
+		return False
+
+	def fileno(self):
+		"""A file descriptor which becomes readable when a job is done"""
+		return self.wakeup.fileno()
 
-		if state:
-			self.queue[0].pause()
+	def get_wait_time(self):
+		"""
+		How long a BlockingCall may wait for something to happen.  This is
+		short when there are no worker threads, since it blocks the UI then.
+		"""
+		if self._get_pool() is None:
+			return self.seconds_of_work_time
+		return self.seconds_of_waiting_time
+
+	def _job_done(self, job):
+		# Called inside the worker thread
+		self.completed.put(job)
+		self.wakeup.wake()
+
+	def _collect_completed(self):
+		"""
+		Mark the jobs which the workers have finished as done, and close
+		the generators of the items which were removed in the meantime
+		"""
+		self.wakeup.clear()
+		try:
+			while True:
+				job = self.completed.get_nowait()
+				job.done = True
+				if job.cancelled:
+					generator, job.generator = job.generator, None
+					self._close(generator)
+		except Empty:
+			pass
+
+	def _get_pool(self):
+		threads = self.fm.settings.loader_threads
+		if not threads or threads < 0:
+			return None
+		if self.pool is None or self.pool.size != threads:
+			if self.pool is not None:
+				self.pool.shutdown()
+			self.pool = WorkerPool(threads, on_done=self._job_done)
+		return self.pool
+
+	def _get_wait_pool(self):
+		"""The pool for WaitingCalls, or None if there are no threads"""
+		if self._get_pool() is None:
+			return None
+		if self.wait_pool is None:
+			self.wait_pool = WorkerPool(self.waiting_threads,
+					on_done=self._job_done)
+		return self.wait_pool
+
+	def reschedule(self):
+		"""
+		Update the priorities, cancel the loads which nobody will see
+		anymore, and sort the queue so the most important items come first
+		"""
+		for item in tuple(self.queue):
+			if item.load_generator is None:
+				self.queue.remove(item)
+				continue
+			priority = item.priority_override
+			if priority is None:
+				try:
+					priority = item.get_priority()
+				except Exception:
+					priority = item.priority
+				if priority >= PRIORITY_STALE and item.cancel_when_stale:
+					self.remove(item)
+					continue
+			item.load_priority = priority
+		items = sorted(self.queue, key=lambda item: item.load_priority)
+		self.queue.clear()
+		self.queue.extend(items)
+
+	def _resume(self, item):
+		"""Run the load_generator of the item until its next yield"""
+		job = item.load_job
+		item.load_job = None
+		if job is None:
+			result = next(item.load_generator)
+		elif job.exc_info:
+			result = item.load_generator.throw(*job.exc_info)
 		else:
-			self.queue[0].unpause()
+			result = item.load_generator.send(job.result)
+
+		if isinstance(result, BlockingCall):
+			result.item = item
+			item.load_job = result
+			if isinstance(result, WaitingCall):
+				pool = self._get_wait_pool()
+			else:
+				pool = self._get_pool()
+			if pool is None:
+				# No threads, so just do it here
+				result.run()
+				result.done = True
+			else:
+				pool.submit(result)
+				return False
+		return True
 
 	def work(self):
 		"""
 		Load items from the queue if there are any.
 		Stop after approximately self.seconds_of_work_time.
+
+		The jobs which the workers finish are collected even while the
+		loader is paused, so fileno() doesn't stay readable:
+
+		>>> from ranger.ext.openstruct import OpenStruct
+		>>> loader = Loader()
+		>>> loader.fm = OpenStruct(settings=OpenStruct(loader_threads=1))
+		>>> loader.pause(1)
+		>>> job = BlockingCall(sum, [1, 2])
+		>>> loader._get_pool().submit(job)
+		>>> select.select([loader], [], [], 5)[0] == [loader]
+		True
+		>>> loader.work()
+		>>> job.done, job.result
+		(True, 3)
+		>>> select.select([loader], [], [], 0)[0]
+		[]
+		>>> loader.destroy()
 		"""
+		self._collect_completed()
 		if self.paused:
 			self.status = self.throbber_paused
 			return
 
-		while True:
-			# get the first item with a proper load_generator
-			try:
-				item = self.queue[0]
-				if item.load_generator is None:
-					self.queue.popleft()
-				else:
-					break
-			except IndexError:
-				return
+		self.reschedule()
 
-		item.unpause()
+		# get the item with the earliest deadline which isn't waiting
+		# for a worker thread or a device
+		item = None
+		earliest = None
+		for test in self.queue:
+			if not self.is_waiting(test) and not self.is_blocked(test):
+				deadline = test.last_serviced + \
+						self.max_wait_time.get(test.load_priority, 0)
+				if earliest is None or deadline < earliest:
+					item = test
+					earliest = deadline
+
+		if item is None:
+			# Everything waits for the workers or devices.  The main loop waits
+			# for self.fileno() to become readable in the meantime.
+			if self.queue:
+				self.rotate()
+			return
 
 		self.rotate()
+		if not item.started:
+			self.starts += 1
+			item.started = self.starts
 		if item != self.old_item:
-			if self.old_item:
+			if self.old_item and not self.is_waiting(self.old_item):
 				self.old_item.pause()
 			self.old_item = item
 		item.unpause()
@@ -335,14 +1433,23 @@ class Loader(FileManagerAware):
 
 		try:
 			while time() < end_time:
-				next(item.load_generator)
+				# Without worker threads, the devices of a file operation
+				# are known right after its first BlockingCall
+				if not self._resume(item) or self.is_blocked(item):
+					break
+			item.last_serviced = time()
 			if item.progressbar_supported:
+				item.stats.update(percent=item.percent)
 				self.fm.ui.status.request_redraw()
 		except StopIteration:
 			item.load_generator = None
 			self.queue.remove(item)
 			if item.progressbar_supported:
+				item.stats.update(percent=100)
 				self.fm.ui.status.request_redraw()
+			if not item.silent:
+				self.fm.signal_emit('loader.finished', loadable=item,
+						stats=item.get_stats())
 		except Exception as err:
 			self.fm.notify(err)
 
@@ -353,3 +1460,12 @@ class Loader(FileManagerAware):
 	def destroy(self):
 		while self.queue:
 			self.queue.pop().destroy()
+		for pool in self.pool, self.wait_pool:
+			if pool is not None:
+				pool.shutdown()
+		self.pool = self.wait_pool = None
+		self.wakeup.close()
+
+if __name__ == '__main__':
+	import doctest
+	doctest.testmod()
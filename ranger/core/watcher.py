@@ -0,0 +1,228 @@
+# Copyright (C) 2009, 2010, 2011  Roman Zimbelmann <romanz@lavabit.com>
+# This software is distributed under the terms of the GNU GPL version 3.
+
+"""
+The Watcher uses inotify to find out when visible directories change.
+
+Watched directories are only reloaded when an event arrives instead of
+being stat()ed on every redraw.  Directories on filesystems where inotify
+doesn't see all changes (like NFS) are left to the usual mtime polling.
+"""
+
+import os
+from time import time
+from ranger.core.shared import FileManagerAware, SettingsAware
+from ranger.ext.mount_path import mount_path
+from ranger.ext import inotify
+
+# Changes on these filesystems can happen on other hosts, unseen by inotify
+UNWATCHABLE_FILESYSTEMS = ('nfs', 'nfs4', 'cifs', 'smbfs', 'smb3', 'ncpfs',
+		'afs', 'coda', '9p', 'fuse', 'fuse.sshfs', 'fuse.rclone', 'davfs',
+		'glusterfs', 'ceph', 'lustre', 'gpfs')
+
+DIRECTORY_EVENTS = inotify.IN_CREATE | inotify.IN_DELETE \
+		| inotify.IN_MOVED_FROM | inotify.IN_MOVED_TO
+FILE_EVENTS = inotify.IN_MODIFY | inotify.IN_ATTRIB | inotify.IN_CLOSE_WRITE
+SELF_EVENTS = inotify.IN_DELETE_SELF | inotify.IN_MOVE_SELF \
+		| inotify.IN_UNMOUNT | inotify.IN_IGNORED
+STAT_SORT_KEYS = ('size', 'mtime', 'ctime', 'atime')
+WATCH_MASK = DIRECTORY_EVENTS | FILE_EVENTS | inotify.IN_DELETE_SELF \
+		| inotify.IN_MOVE_SELF | inotify.IN_ONLYDIR
+
+
+def _read_mounts():
+	"""Returns a dict of {mount point: filesystem type}"""
+	mounts = {}
+	try:
+		f = open('/proc/mounts', 'r')
+	except IOError:
+		return mounts
+	try:
+		for line in f:
+			fields = line.split()
+			if len(fields) >= 3:
+				mounts[fields[1].replace('\\040', ' ')] = fields[2]
+	finally:
+		f.close()
+	return mounts
+
+
+class Watcher(FileManagerAware, SettingsAware):
+	inotify = None
+	mounts = None
+
+	def __init__(self):
+		self.watches = {}        # path => (wd, directory)
+		self.paths = {}          # wd => path
+		self.watched_paths = set()
+		self.unwatchable = set()
+		self.old_visible = None
+
+	def is_active(self):
+		return self.inotify is not None
+
+	def fileno(self):
+		return self.inotify.fd if self.inotify else -1
+
+	def start(self):
+		"""Set up inotify.  Returns False if it's unavailable"""
+		if self.inotify is None:
+			try:
+				self.inotify = inotify.Inotify()
+			except OSError:
+				return False
+			self.mounts = _read_mounts()
+		return True
+
+	def stop(self):
+		"""Remove all watches and return to polling"""
+		for path in tuple(self.watches):
+			self._unwatch(path)
+		if self.inotify is not None:
+			self.inotify.close()
+			self.inotify = None
+		self.unwatchable.clear()
+		self.old_visible = None
+
+	def destroy(self):
+		self.stop()
+
+	def visible_directories(self):
+		"""The directories which are displayed in any tab"""
+		result = set()
+		directories = self.fm.directories
+		for tab in self.fm.tabs.values():
+			result.update(tab.pathway)
+			thisfile = tab.thisfile
+			if thisfile is not None and thisfile.is_directory:
+				try:
+					result.add(directories[thisfile.path])
+				except KeyError:
+					pass
+		return result
+
+	def update(self):
+		"""Watch the visible directories and stop watching the others"""
+		if not self.settings.use_inotify:
+			if self.inotify is not None:
+				self.stop()
+			return
+		if not self.start():
+			return
+
+		visible = self.visible_directories()
+		if visible == self.old_visible:
+			return
+		self.old_visible = visible
+
+		visible_paths = set(d.path for d in visible)
+		for path in tuple(self.watches):
+			if path not in visible_paths:
+				self._unwatch(path)
+		for directory in visible:
+			if directory.path not in self.watches \
+					and directory.path not in self.unwatchable:
+				self._watch(directory)
+
+	def _watchable(self, path):
+		mount = mount_path(path)
+		if mount not in self.mounts:
+			# It may have been mounted after the mounts were read
+			self.mounts = _read_mounts()
+		fstype = self.mounts.get(mount)
+		if fstype is None:
+			return False  # better poll than miss changes
+		return fstype not in UNWATCHABLE_FILESYSTEMS \
+				and not fstype.startswith('fuse.')
+
+	def _watch(self, directory):
+		path = directory.path
+		if not self._watchable(path):
+			self.unwatchable.add(path)
+			return
+		try:
+			wd = self.inotify.add_watch(path, WATCH_MASK)
+		except OSError:
+			# e.g. no permission or the limit of watches is reached
+			self.unwatchable.add(path)
+			return
+		self.watches[path] = (wd, directory)
+		self.paths[wd] = path
+		self.watched_paths.add(path)
+		directory.watched = True
+		# Files may have changed while we didn't watch, so recheck them all
+		directory.changed_names = None
+		# Check once for changes which happened before the watch was set up
+		if directory.content_loaded:
+			try:
+				if os.stat(path).st_mtime != directory.load_content_mtime:
+					directory.content_outdated = True
+			except OSError:
+				directory.content_outdated = True
+
+	def _unwatch(self, path, remove_watch=True):
+		try:
+			wd, directory = self.watches.pop(path)
+		except KeyError:
+			return
+		self.paths.pop(wd, None)
+		self.watched_paths.discard(path)
+		directory.watched = False
+		if remove_watch and self.inotify is not None:
+			self.inotify.rm_watch(wd)
+
+	def process_events(self):
+		"""
+		Mark directories as outdated according to the pending events.
+		Returns True if anything has changed.
+		"""
+		if self.inotify is None:
+			return False
+		try:
+			events = self.inotify.read_events()
+		except OSError:
+			return False
+		if not events:
+			return False
+
+		modified = {}
+		for wd, mask, cookie, name in events:
+			if mask & inotify.IN_Q_OVERFLOW:
+				# Events were lost, so everything may be outdated
+				for wd_, directory in self.watches.values():
+					directory.content_outdated = True
+					directory.changed_names = None
+				continue
+			try:
+				path = self.paths[wd]
+				directory = self.watches[path][1]
+			except KeyError:
+				continue
+			if name and directory.changed_names is not None:
+				# The reload re-stats the files which were named by events
+				directory.changed_names.add(name)
+			if mask & SELF_EVENTS:
+				directory.content_outdated = True
+				# The kernel removes the watch by itself, with an
+				# IN_IGNORED, except when the directory was moved
+				self._unwatch(path,
+						remove_watch=bool(mask & inotify.IN_MOVE_SELF))
+				self.old_visible = None
+			elif mask & DIRECTORY_EVENTS or not name:
+				directory.content_outdated = True
+				if not name:
+					directory.changed_names = None
+			elif mask & FILE_EVENTS:
+				modified.setdefault(directory, set()).add(name)
+
+		# Reload only the modified files instead of the whole directory
+		for directory, names in modified.items():
+			if directory.content_outdated or directory.files is None:
+				continue
+			for fobj in directory.files:
+				if fobj.basename in names and fobj.loaded:
+					fobj.load()
+			if directory.settings.sort in STAT_SORT_KEYS:
+				directory.order_outdated = True
+			directory.last_update_time = time()
+		return True
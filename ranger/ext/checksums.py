@@ -0,0 +1,165 @@
+# Copyright (C) 2009, 2010, 2011  Roman Zimbelmann <romanz@lavabit.com>
+# This software is distributed under the terms of the GNU GPL version 3.
+
+"""
+Checksums of copied files, to verify the copies afterwards.
+
+The copy functions of ranger.ext.shutil_generatorized hash the data while
+it's copied and add the digest with add().  verify() then reads the
+copies back, yielding the number of bytes after every chunk, and
+collects the ones which differ in mismatches.
+
+Before a copy is read back, it is written to the disk with fsync() and
+dropped from the page cache with posix_fadvise(), so the data comes from
+the disk and not from the memory.  Where posix_fadvise() isn't available,
+like on python 2, the copies are only synced and may be read from the
+page cache, so only errors of the copying itself are found, not the ones
+of writing to the disk.  The kernel may ignore the advice too, e.g. on
+some network filesystems.
+
+>>> import tempfile, shutil
+>>> directory = tempfile.mkdtemp()
+>>> a, b = os.path.join(directory, 'a'), os.path.join(directory, 'b')
+>>> for path in a, b:
+... 	f = open(path, 'wb')
+... 	_ = f.write(b'data')
+... 	f.close()
+>>> checksums = Checksums('sha256')
+>>> hasher = checksums.new()
+>>> hasher.update(b'data')
+>>> checksums.add(a, b, hasher.digest(), 4)
+>>> checksums.add(a, b, None, 4)
+>>> checksums.size
+12
+>>> sum(checksums.verify())
+12
+>>> checksums.mismatches
+[]
+>>> f = open(b, 'ab')
+>>> _ = f.write(b'!')
+>>> f.close()
+>>> _ = sum(checksums.verify())
+>>> len(checksums.mismatches)
+2
+
+Sources which are removed after copying, like when moving files, are
+hashed with hash_sources() before:
+
+>>> f = open(b, 'wb')
+>>> _ = f.write(b'data')
+>>> f.close()
+>>> checksums = Checksums('sha256')
+>>> checksums.add(a, b, None, 4)
+>>> sum(checksums.hash_sources(directory)), checksums.size
+(4, 4)
+>>> os.remove(a)
+>>> _ = sum(checksums.verify())
+>>> checksums.mismatches
+[]
+>>> shutil.rmtree(directory)
+"""
+
+import os
+import hashlib
+import threading
+
+CHUNK_SIZE = 1024 * 1024
+
+def _drop_cache(f):
+	"""Write the file to the disk and drop its pages from the cache"""
+	fd = f.fileno()
+	try:
+		os.fsync(fd)
+	except OSError:
+		pass
+	if hasattr(os, 'posix_fadvise'):
+		try:
+			os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+		except OSError:
+			pass
+
+class Checksums(object):
+	def __init__(self, algorithm):
+		"""Raises ValueError if hashlib doesn't know the algorithm"""
+		hashlib.new(algorithm)
+		self.algorithm = algorithm
+		self.files = []  # (src, dst, digest or None, size)
+		self.size = 0    # the number of bytes which verify() reads
+		self.mismatches = []  # (dst, reason)
+		self.lock = threading.Lock()
+
+	def new(self):
+		"""A hashlib object for hashing a file"""
+		return hashlib.new(self.algorithm)
+
+	def add(self, src, dst, digest, size):
+		"""
+		Add a copied file of that size.  If the digest of src is None, it
+		is computed when verifying.  May be called by several threads.
+		"""
+		with self.lock:
+			self.files.append((src, dst, digest, size))
+			if digest is None:
+				self.size += 2 * size
+			else:
+				self.size += size
+
+	def _hash(self, path, hasher, from_disk=False):
+		f = open(path, 'rb')
+		try:
+			if from_disk:
+				_drop_cache(f)
+			while True:
+				buf = f.read(CHUNK_SIZE)
+				if not buf:
+					break
+				hasher.update(buf)
+				yield len(buf)
+		finally:
+			f.close()
+
+	def hash_sources(self, path):
+		"""
+		Compute the missing digests of the sources in path, or of path
+		itself, before they're removed.  Yields like verify().
+		"""
+		prefix = os.path.join(path, '')
+		with self.lock:
+			missing = [i for i, (src, dst, digest, size)
+					in enumerate(self.files) if digest is None
+					and (src == path or src.startswith(prefix))]
+		for i in missing:
+			src, dst, digest, size = self.files[i]
+			hasher = self.new()
+			try:
+				for read in self._hash(src, hasher):
+					yield read
+			except (IOError, OSError):
+				continue  # verify() will tell
+			with self.lock:
+				self.files[i] = (src, dst, hasher.digest(), size)
+				self.size -= size
+
+	def verify(self):
+		"""Compare the copies with the originals, see the module docstring"""
+		self.mismatches = []
+		for src, dst, digest, size in self.files:
+			try:
+				if digest is None:
+					hasher = self.new()
+					for read in self._hash(src, hasher):
+						yield read
+					digest = hasher.digest()
+				hasher = self.new()
+				for read in self._hash(dst, hasher, from_disk=True):
+					yield read
+			except (IOError, OSError) as err:
+				self.mismatches.append((dst, str(err)))
+				continue
+			if hasher.digest() != digest:
+				self.mismatches.append((dst,
+						"the %s checksum differs" % self.algorithm))
+
+if __name__ == '__main__':
+	import doctest
+	doctest.testmod()
@@ -0,0 +1,220 @@
+# Copyright (C) 2009, 2010, 2011  Roman Zimbelmann <romanz@lavabit.com>
+# This software is distributed under the terms of the GNU GPL version 3.
+
+"""
+A journal of a copy job, so it can be resumed after a crash.
+
+The journal is a file with one JSON list per line:
+
+	["job", info]               info is a dict describing the job
+	["destination", src, dst]   where a copied item goes
+	["offset", dst, n, size, mtime]
+	                            the first n bytes of dst are copied from a
+	                            source file with that size and mtime
+	["done", dst]               dst is completely copied
+
+The functions of ranger.ext.shutil_generatorized take the journal as an
+optional argument.  When a journal is resumed, files whose destination
+has the size and mtime of the source are skipped and partially copied
+files are continued from the recorded offset.
+
+While a journal is used, it is locked, so other processes won't try to
+resume a running job.
+
+>>> import tempfile, shutil
+>>> directory = tempfile.mkdtemp()
+>>> journal = CopyJournal.create(directory, {'target': '/tmp'})
+>>> journal.destination('/a/b', '/tmp/b')
+>>> st = os.stat_result((0, 0, 0, 0, 0, 0, 5000, 0, 0, 0))
+>>> journal.progress('/tmp/b/c', 1000, st)
+>>> journal.close()
+>>> paths = CopyJournal.find(directory)
+>>> len(paths)
+1
+>>> journal = CopyJournal(paths[0])
+>>> journal.info['target'], journal.destinations['/a/b']
+('/tmp', '/tmp/b')
+>>> isinstance(journal.destinations['/a/b'], str)
+True
+>>> journal.offsets['/tmp/b/c'][0]
+1000
+>>> journal.remove()
+>>> CopyJournal.find(directory)
+[]
+>>> shutil.rmtree(directory)
+"""
+
+import os
+import sys
+import json
+import threading
+from time import time
+try:
+	import fcntl
+except ImportError:
+	fcntl = None
+
+_encoding = sys.getfilesystemencoding() or 'utf-8'
+_py3 = sys.version_info >= (3, )
+
+def _native(obj):
+	"""Turn the unicode strings which json returns on python2 into the
+	byte strings which are used for paths everywhere else"""
+	if _py3:
+		return obj
+	if isinstance(obj, unicode):
+		return obj.encode(_encoding)
+	if isinstance(obj, list):
+		return [_native(item) for item in obj]
+	if isinstance(obj, dict):
+		return dict((_native(key), _native(value))
+				for key, value in obj.items())
+	return obj
+
+class CopyJournal(object):
+	interval = 1.0  # seconds between writes to the disk
+
+	def __init__(self, path, resumed=True):
+		"""Open an existing journal.  Raises IOError if it's in use"""
+		self.path = path
+		self.resumed = resumed
+		self.info = {}
+		self.destinations = {}  # src => dst
+		self.offsets = {}       # dst => (offset, size, mtime)
+		self.done = set()
+		self.lock = threading.Lock()
+		self.last_flush = 0
+		self.last_progress = {}
+		self.file = open(path, 'a+')
+		try:
+			_lock(self.file)
+		except IOError:
+			self.file.close()
+			raise
+		if resumed:
+			self.file.seek(0)
+			self._parse(self.file.read())
+
+	@classmethod
+	def create(cls, directory, info):
+		"""Start a new journal for a job which is described by info"""
+		if not os.path.isdir(directory):
+			os.makedirs(directory)
+		path = os.path.join(directory, '%d-%d' % (os.getpid(), time() * 1000))
+		journal = cls(path, resumed=False)
+		journal.info = info
+		journal._write(['job', info], flush=True)
+		return journal
+
+	@staticmethod
+	def find(directory):
+		"""The paths of the journals of jobs which are not running"""
+		try:
+			names = sorted(os.listdir(directory))
+		except OSError:
+			return []
+		result = []
+		for name in names:
+			path = os.path.join(directory, name)
+			try:
+				f = open(path, 'a')
+			except IOError:
+				continue
+			try:
+				_lock(f)
+			except IOError:
+				pass  # it's in use
+			else:
+				result.append(path)
+			f.close()
+		return result
+
+	def _parse(self, content):
+		for line in content.splitlines():
+			try:
+				record = _native(json.loads(line))
+			except ValueError:
+				continue  # the end of a line which was cut off
+			kind = record[0]
+			if kind == 'job':
+				self.info = record[1]
+			elif kind == 'destination':
+				self.destinations[record[1]] = record[2]
+			elif kind == 'offset':
+				self.offsets[record[1]] = tuple(record[2:])
+			elif kind == 'done':
+				self.done.add(record[1])
+				self.offsets.pop(record[1], None)
+
+	def _write(self, record, flush=False):
+		with self.lock:
+			if self.file is None:
+				return
+			self.file.write(json.dumps(record) + '\n')
+			now = time()
+			if flush or now - self.last_flush >= self.interval:
+				self.file.flush()
+				self.last_flush = now
+
+	def destination(self, src, dst):
+		"""Record where an item of the job is copied to"""
+		self.destinations[src] = dst
+		self._write(['destination', src, dst], flush=True)
+
+	def resume_offset(self, src, dst, st):
+		"""
+		The offset from which copying src to dst should continue, or None
+		if dst is complete already.  st is the os.stat() of src.
+		"""
+		if not self.resumed or st is None:
+			return 0
+		try:
+			dst_st = os.stat(dst)
+		except OSError:
+			return 0
+		if dst_st.st_size == st.st_size \
+				and int(dst_st.st_mtime) == int(st.st_mtime):
+			return None
+		try:
+			offset, size, mtime = self.offsets[dst]
+		except KeyError:
+			return 0
+		if size == st.st_size and int(mtime) == int(st.st_mtime) \
+				and dst_st.st_size >= offset:
+			return offset
+		return 0
+
+	def progress(self, dst, offset, st):
+		"""Record that the first bytes of dst are copied"""
+		now = time()
+		if offset < st.st_size \
+				and now - self.last_progress.get(dst, 0) >= self.interval:
+			self.last_progress[dst] = now
+			self._write(['offset', dst, offset, st.st_size, st.st_mtime])
+
+	def finished(self, dst):
+		"""Record that dst is completely copied"""
+		self.last_progress.pop(dst, None)
+		self._write(['done', dst])
+
+	def close(self):
+		with self.lock:
+			if self.file is not None:
+				self.file.close()
+				self.file = None
+
+	def remove(self):
+		"""Delete the journal once the job is complete"""
+		self.close()
+		try:
+			os.remove(self.path)
+		except OSError:
+			pass
+
+def _lock(f):
+	if fcntl is not None:
+		fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+if __name__ == '__main__':
+	import doctest
+	doctest.testmod()
@@ -42,6 +42,24 @@ def human_readable(byte, separator=' '):
 		return '%.4g%sP' % (byte / 2**50.0, separator)
 	return '>9000'
 
+def human_readable_time(seconds):
+	"""
+	Convert a number of seconds to hours, minutes and seconds.
+
+	>>> human_readable_time(5.7)
+	'0:05'
+	>>> human_readable_time(125)
+	'2:05'
+	>>> human_readable_time(3 * 3600 + 61)
+	'3:01:01'
+	"""
+	seconds = int(seconds)
+	hours, seconds = divmod(seconds, 3600)
+	minutes, seconds = divmod(seconds, 60)
+	if hours:
+		return '%d:%02d:%02d' % (hours, minutes, seconds)
+	return '%d:%02d' % (minutes, seconds)
+
 if __name__ == '__main__':
 	import doctest
 	doctest.testmod()
@@ -0,0 +1,123 @@
+# Copyright (C) 2009, 2010, 2011  Roman Zimbelmann <romanz@lavabit.com>
+# This software is distributed under the terms of the GNU GPL version 3.
+
+"""
+A minimal wrapper around the inotify API of Linux, using ctypes.
+
+Check inotify.available before use.  Instances of Inotify provide a
+non-blocking file descriptor (Inotify.fd) and read_events() returns the
+pending events as (wd, mask, cookie, name) tuples.
+"""
+
+import os
+import sys
+import struct
+from errno import EAGAIN, EINTR
+
+IN_ACCESS        = 0x00000001
+IN_MODIFY        = 0x00000002
+IN_ATTRIB        = 0x00000004
+IN_CLOSE_WRITE   = 0x00000008
+IN_CLOSE_NOWRITE = 0x00000010
+IN_OPEN          = 0x00000020
+IN_MOVED_FROM    = 0x00000040
+IN_MOVED_TO      = 0x00000080
+IN_CREATE        = 0x00000100
+IN_DELETE        = 0x00000200
+IN_DELETE_SELF   = 0x00000400
+IN_MOVE_SELF     = 0x00000800
+IN_UNMOUNT       = 0x00002000
+IN_Q_OVERFLOW    = 0x00004000
+IN_IGNORED       = 0x00008000
+IN_ONLYDIR       = 0x01000000
+IN_DONT_FOLLOW   = 0x02000000
+IN_ISDIR         = 0x40000000
+
+IN_NONBLOCK      = 0o4000
+IN_CLOEXEC       = 0o2000000
+
+_EVENT_HEADER = struct.Struct('iIII')
+_BUFFER_SIZE = 64 * 1024
+
+try:
+	import ctypes
+	import ctypes.util
+	_libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+			use_errno=True)
+	_libc.inotify_init1
+	_libc.inotify_add_watch
+	_libc.inotify_rm_watch
+except (ImportError, OSError, AttributeError):
+	available = False
+else:
+	available = sys.platform.startswith('linux')
+
+_encoding = sys.getfilesystemencoding() or 'utf-8'
+_py3 = sys.version_info >= (3, )
+
+def _encode(path):
+	if _py3:
+		return path.encode(_encoding, 'surrogateescape')
+	return path
+
+def _decode(name):
+	if _py3:
+		return name.decode(_encoding, 'surrogateescape')
+	return name
+
+def _error():
+	errno = ctypes.get_errno()
+	return OSError(errno, os.strerror(errno))
+
+
+class Inotify(object):
+	"""An inotify instance with its own file descriptor and watches"""
+
+	def __init__(self):
+		if not available:
+			raise OSError("inotify is not available")
+		self.fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+		if self.fd < 0:
+			raise _error()
+
+	def add_watch(self, path, mask):
+		"""Watch the path for the events in mask.  Returns a watch descriptor"""
+		wd = _libc.inotify_add_watch(self.fd, _encode(path), mask)
+		if wd < 0:
+			raise _error()
+		return wd
+
+	def rm_watch(self, wd):
+		"""Remove a watch.  Errors are ignored since the kernel removes
+		watches of deleted files by itself."""
+		_libc.inotify_rm_watch(self.fd, wd)
+
+	def read_events(self):
+		"""Return a list of all pending (wd, mask, cookie, name) tuples"""
+		events = []
+		while True:
+			try:
+				data = os.read(self.fd, _BUFFER_SIZE)
+			except OSError as err:
+				if err.errno == EINTR:
+					continue
+				if err.errno == EAGAIN:
+					return events
+				raise
+			if not data:
+				return events
+			pos = 0
+			while pos + _EVENT_HEADER.size <= len(data):
+				wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, pos)
+				pos += _EVENT_HEADER.size
+				name = data[pos:pos + length].rstrip(b'\0')
+				pos += length
+				events.append((wd, mask, cookie, _decode(name)))
+
+	def close(self):
+		if self.fd >= 0:
+			os.close(self.fd)
+			self.fd = -1
+
+	def fileno(self):
+		return self.fd
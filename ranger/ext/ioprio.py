@@ -0,0 +1,91 @@
+# Copyright (C) 2009, 2010, 2011  Roman Zimbelmann <romanz@lavabit.com>
+# This software is distributed under the terms of the GNU GPL version 3.
+
+"""
+Change the I/O priority of the current thread with ioprio_set() of Linux.
+
+Threads started by a thread inherit its I/O priority.  Elsewhere, or on
+architectures whose syscall numbers aren't known, the functions do
+nothing and return None.
+
+>>> old = set_priority(IOPRIO_CLASS_BE, 7)
+>>> old is None or get_priority() == ioprio(IOPRIO_CLASS_BE, 7)
+True
+>>> restore_priority(old)
+"""
+
+import sys
+import platform
+
+IOPRIO_CLASS_NONE = 0
+IOPRIO_CLASS_RT = 1
+IOPRIO_CLASS_BE = 2
+IOPRIO_CLASS_IDLE = 3
+
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_SHIFT = 13
+
+# The names of the setting copy_io_priority
+PRIORITIES = {
+	'normal': None,
+	'best-effort': (IOPRIO_CLASS_BE, 7),
+	'idle': (IOPRIO_CLASS_IDLE, 0),
+}
+
+# (ioprio_set, ioprio_get) for each architecture
+_SYSCALLS = {
+	'x86_64': (251, 252),
+	'i386': (289, 290),
+	'i686': (289, 290),
+	'aarch64': (30, 31),
+	'armv7l': (314, 315),
+	'ppc64le': (273, 274),
+	'ppc64': (273, 274),
+	's390x': (282, 283),
+	'riscv64': (30, 31),
+}
+
+try:
+	import ctypes
+	import ctypes.util
+	_libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+			use_errno=True)
+	_libc.syscall
+except (ImportError, OSError, AttributeError):
+	_numbers = None
+else:
+	if sys.platform.startswith('linux'):
+		_numbers = _SYSCALLS.get(platform.machine())
+	else:
+		_numbers = None
+
+def ioprio(ioclass, data=0):
+	return (ioclass << IOPRIO_CLASS_SHIFT) | data
+
+def get_priority():
+	"""The I/O priority of this thread, or None if it's unknown"""
+	if _numbers is None:
+		return None
+	value = _libc.syscall(_numbers[1], IOPRIO_WHO_PROCESS, 0)
+	if value < 0:
+		return None
+	return value
+
+def set_priority(ioclass, data=0):
+	"""Set the I/O priority of this thread.  Returns the old one or None"""
+	old = get_priority()
+	if old is None:
+		return None
+	if _libc.syscall(_numbers[0], IOPRIO_WHO_PROCESS, 0,
+			ioprio(ioclass, data)) < 0:
+		return None
+	return old
+
+def restore_priority(old):
+	"""Undo set_priority(), which returned old"""
+	if old is not None and _numbers is not None:
+		_libc.syscall(_numbers[0], IOPRIO_WHO_PROCESS, 0, old)
+
+if __name__ == '__main__':
+	import doctest
+	doctest.testmod()
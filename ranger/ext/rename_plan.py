@@ -0,0 +1,95 @@
+# Copyright (C) 2009, 2010, 2011  Roman Zimbelmann <romanz@lavabit.com>
+# This software is distributed under the terms of the GNU GPL version 3.
+
+"""
+Find an order in which many files can be renamed without clobbering each
+other, like for swapping the names of two files.
+
+The renames form chains, like a -> b -> c, which are done from the end,
+and cycles, like a -> b -> a, which are broken up by moving one file to a
+temporary name first.
+
+>>> existing = set(['/d/a', '/d/b', '/d/c'])
+>>> plan_renames([('/d/a', '/d/b'), ('/d/b', '/d/c'), ('/d/c', '/d/x')],
+... 		exists=existing.__contains__)
+[('/d/c', '/d/x'), ('/d/b', '/d/c'), ('/d/a', '/d/b')]
+>>> plan_renames([('/d/a', '/d/b'), ('/d/b', '/d/a'), ('/d/c', '/d/c')],
+... 		exists=existing.__contains__)
+[('/d/a', '/d/.a.ranger-rename'), ('/d/b', '/d/a'), ('/d/.a.ranger-rename', '/d/b')]
+>>> plan_renames([('/d/a', '/d/c')], exists=existing.__contains__)
+Traceback (most recent call last):
+ValueError: /d/c already exists
+>>> plan_renames([('/d/a', '/d/x'), ('/d/b', '/d/x')],
+... 		exists=existing.__contains__)
+Traceback (most recent call last):
+ValueError: more than one file would be renamed to /d/x
+"""
+
+import os
+
+def plan_renames(renames, exists=os.path.lexists):
+	"""
+	Takes (old path, new path) tuples and returns a list of them in which
+	they can be passed to os.rename().  Raises ValueError if the renames
+	would overwrite a file.
+	"""
+	targets = {}  # src => dst
+	sources = {}  # dst => src
+	order = []
+	for src, dst in renames:
+		if src == dst:
+			continue
+		if src in targets:
+			raise ValueError("%s would be renamed twice" % src)
+		if dst in sources:
+			raise ValueError("more than one file would be renamed to %s" % dst)
+		targets[src] = dst
+		sources[dst] = src
+		order.append(src)
+
+	for src in order:
+		dst = targets[src]
+		if dst not in targets and exists(dst):
+			raise ValueError("%s already exists" % dst)
+
+	taken = set(targets)
+	taken.update(sources)
+	plan = []
+
+	# Start each chain at its end, whose target is free.  Every rename
+	# frees the name which the previous one in the chain needs.
+	for src in order:
+		if targets[src] in targets:
+			continue
+		while src in targets:
+			plan.append((src, targets.pop(src)))
+			src = sources.get(src)
+
+	# Only cycles are left
+	for src in order:
+		if src not in targets:
+			continue
+		temp = _temporary_name(src, exists, taken)
+		dst = targets.pop(src)
+		plan.append((src, temp))
+		current = sources[src]
+		while current != src:
+			plan.append((current, targets.pop(current)))
+			current = sources[current]
+		plan.append((temp, dst))
+	return plan
+
+def _temporary_name(path, exists, taken):
+	directory, name = os.path.split(path)
+	n = 0
+	while True:
+		temp = os.path.join(directory,
+				'.%s.ranger-rename%s' % (name, n or ''))
+		if temp not in taken and not exists(temp):
+			taken.add(temp)
+			return temp
+		n += 1
+
+if __name__ == '__main__':
+	import doctest
+	doctest.testmod()
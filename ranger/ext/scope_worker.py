@@ -0,0 +1,230 @@
+# Copyright (C) 2009, 2010, 2011  Roman Zimbelmann <romanz@lavabit.com>
+# This software is distributed under the terms of the GNU GPL version 3.
+
+"""
+A long-lived shell which runs the preview script for one file after
+another, instead of starting a new shell for each of them.
+
+The worker reads requests of three lines, the width, the height and the
+path, from its stdin.  For each one, it sources the script in a subshell
+with "$0", "$1", "$2" and "$3" set like on the command line, so "exit 5"
+and the other exit codes keep working.  The output is followed by a line with a
+random token and the exit code, which marks the end of the response.
+
+Only scripts for a known shell can be run like this, see shell_of().
+
+>>> import tempfile, shutil
+>>> directory = tempfile.mkdtemp()
+>>> script = os.path.join(directory, 'scope.sh')
+>>> f = open(script, 'w')
+>>> _ = f.write('#!/bin/sh\\necho "${0##*/}: $1 is $2x$3"\\n'
+... 		'[ "$1" = b ] && exit 5\\nexit 1\\n')
+>>> f.close()
+>>> pool = ScopeWorkerPool()
+>>> worker = pool.acquire(script)
+>>> for path in 'a', 'b':
+... 	worker.request(path, 80, 24)
+... 	while not worker.receive(1):
+... 		pass
+... 	print('%d %s' % (worker.exit_code, worker.output.decode().strip()))
+1 scope.sh: a is 80x24
+5 scope.sh: b is 80x24
+>>> pool.release(worker)
+>>> pool.acquire(script) is worker
+True
+>>> worker.kill()
+>>> pool.release(worker)
+>>> worker.process.stdout.closed
+True
+>>> pool.idle
+[]
+>>> pool.shutdown()
+>>> shutil.rmtree(directory)
+"""
+
+import os
+import re
+import sys
+import random
+import select
+import signal
+from subprocess import Popen, PIPE
+try:
+	from os import fsencode
+except ImportError:
+	fsencode = lambda path: path.encode('utf-8')
+
+SHELLS = ('sh', 'bash', 'dash', 'ksh', 'mksh', 'zsh', 'ash', 'posh')
+
+WORKER_LOOP = r'''
+__ranger_script=$0 __ranger_token=$1
+while IFS= read -r __ranger_width && IFS= read -r __ranger_height \
+		&& IFS= read -r __ranger_path; do
+	(set -- "$__ranger_path" "$__ranger_width" "$__ranger_height"
+		. "$__ranger_script") < /dev/null 2> /dev/null
+	printf '\n%s %d\n' "$__ranger_token" "$?"
+done
+'''
+
+def shell_of(script):
+	"""
+	The command which runs the shell from the #! line of the script,
+	or None if it isn't a shell script
+
+	>>> shell_of('/nonexistent') is None
+	True
+	"""
+	try:
+		f = open(script, 'rb')
+		try:
+			line = f.readline(256).decode('utf-8', 'replace')
+		finally:
+			f.close()
+	except (IOError, OSError):
+		return None
+	if not line.startswith('#!'):
+		return None
+	command = line[2:].split()
+	if command and os.path.basename(command[0]) == 'env':
+		command = command[1:]
+	# Options like "-e" would be lost in the subshell
+	if len(command) != 1 or os.path.basename(command[0]) not in SHELLS:
+		return None
+	return command
+
+class ScopeWorker(object):
+	def __init__(self, script, shell):
+		self.script = script
+		self.token = '%032x' % random.getrandbits(128)
+		self.end = re.compile(('\n%s (-?[0-9]+)\n' % self.token).encode())
+		if sys.version_info >= (3, 2):
+			session = dict(start_new_session=True)
+		else:
+			# not safe with threads, but python 2 has nothing else
+			session = dict(preexec_fn=os.setsid)
+		null = open(os.devnull, 'w')
+		try:
+			# The script is $0 of the shell, like when it's run directly
+			self.process = Popen(shell + ['-c', WORKER_LOOP, script,
+				self.token], stdin=PIPE, stdout=PIPE, stderr=null,
+				close_fds=True, **session)
+		finally:
+			null.close()
+		self.busy = False
+		self.exit_code = None
+		self.output = None
+		self.buffer = b''
+
+	def alive(self):
+		return self.process.poll() is None
+
+	def request(self, path, width, height):
+		"""Ask for the preview of path.  Raises OSError if the worker died"""
+		if '\n' in path:
+			raise ValueError("the path can't be passed to the worker")
+		self.busy = True
+		self.exit_code = None
+		self.output = None
+		self.buffer = b''
+		if not isinstance(path, bytes):
+			path = fsencode(path)
+		try:
+			self.process.stdin.write(('%d\n%d\n' % (width, height)).encode()
+					+ path + b'\n')
+			self.process.stdin.flush()
+		except IOError as err:
+			raise OSError(str(err))
+
+	def receive(self, timeout):
+		"""
+		Read the response for up to timeout seconds.  Returns True once
+		it's complete, then exit_code and output are set.  If the worker
+		died, exit_code is None.
+		"""
+		fd = self.process.stdout.fileno()
+		if not select.select([fd], [], [], timeout)[0]:
+			return False
+		data = os.read(fd, 65536)
+		if not data:
+			self.busy = False
+			self.output = self.buffer
+			self.kill()
+			return True
+		# The token may be split up between two reads
+		start = max(0, len(self.buffer) - len(self.token) - 32)
+		self.buffer += data
+		match = self.end.search(self.buffer, start)
+		if match is None:
+			return False
+		self.busy = False
+		self.exit_code = int(match.group(1))
+		self.output = self.buffer[:match.start()]
+		self.buffer = b''
+		return True
+
+	def send_signal(self, signum):
+		"""Send the signal to the worker and the programs it started"""
+		if self.process.poll() is None:
+			try:
+				os.killpg(self.process.pid, signum)
+			except OSError:
+				pass
+
+	def kill(self):
+		"""
+		Stop the worker.  A receive() in another thread then returns
+		because the pipe is closed
+		"""
+		self.send_signal(signal.SIGKILL)
+		self.process.wait()
+
+	def close(self):
+		"""Stop the worker and close its pipes, once nothing reads them"""
+		self.kill()
+		for pipe in (self.process.stdin, self.process.stdout):
+			try:
+				pipe.close()
+			except IOError:
+				pass  # the unflushed rest of a request
+
+class ScopeWorkerPool(object):
+	"""Keeps a few idle workers around for the next previews"""
+	max_idle = 3
+
+	def __init__(self):
+		self.idle = []
+
+	def acquire(self, script):
+		"""
+		An idle worker for the script, or a new one.  Returns None if
+		the script can't be run by a worker
+		"""
+		script = os.path.abspath(script)
+		while self.idle:
+			worker = self.idle.pop()
+			if worker.script == script and worker.alive():
+				return worker
+			worker.close()
+		shell = shell_of(script)
+		if shell is None:
+			return None
+		try:
+			return ScopeWorker(script, shell)
+		except OSError:
+			return None
+
+	def release(self, worker):
+		"""Give back a worker which has finished its request"""
+		if worker.busy or not worker.alive() \
+				or len(self.idle) >= self.max_idle:
+			worker.close()
+		else:
+			self.idle.append(worker)
+
+	def shutdown(self):
+		while self.idle:
+			self.idle.pop().close()
+
+if __name__ == '__main__':
+	import doctest
+	doctest.testmod()
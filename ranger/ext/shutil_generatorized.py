@@ -1,5 +1,6 @@
 # This file was taken from the python standard library and has been
-# slightly modified to do a "yield" after every 16KB of copying
+# slightly modified to do a "yield" after every chunk of copying.  The
+# generators yield the number of bytes copied in that chunk.
 """Utility functions for copying files and directory trees.
 
 XXX The functions here don't copy the resource fork or other metadata on Mac.
@@ -9,14 +10,65 @@ XXX The functions here don't copy the resource fork or other metadata on Mac.
 import os
 import sys
 import stat
+import errno
+import threading
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+from time import time
 from os.path import abspath
+from collections import deque
+try:
+    from os import scandir
+except ImportError:
+    scandir = None
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
+from ranger.ext.worker_pool import WorkerPool
 
 __all__ = ["copyfileobj","copyfile","copystat","copy2","BLOCK_SIZE",
-           "copytree","move","rmtree","Error", "SpecialFileError"]
+           "copytree","move","rmtree","Error", "SpecialFileError", "Cloned",
+           "Planned", "Finished", "CopyControl"]
 
 APPENDIX = '_'
 BLOCK_SIZE = 16 * 1024
 
+# When the kernel copies the data (copy_file_range or sendfile), the chunks
+# are sized so that each one takes about SECONDS_PER_CHUNK, which is the
+# time slice of ranger's loader.
+SECONDS_PER_CHUNK = 0.03
+INITIAL_CHUNK_SIZE = 1024 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+
+# Errors meaning that a kernel copy function can't be used for these files
+_UNSUPPORTED_ERRNOS = set(getattr(errno, name) for name in ('ENOSYS',
+    'EXDEV', 'EINVAL', 'EOPNOTSUPP', 'ENOTSUP', 'EPERM', 'EBADF',
+    'ENOTSOCK', 'ETXTBSY') if hasattr(errno, name))
+
+def _copy_file_range(src_fd, dst_fd, count, offset):
+    return os.copy_file_range(src_fd, dst_fd, count, offset, offset)
+
+def _sendfile(src_fd, dst_fd, count, offset):
+    return os.sendfile(dst_fd, src_fd, offset, count)
+
+# The ioctl of Linux which makes a file share the data of another one
+# (a reflink) on copy-on-write filesystems like btrfs or XFS
+FICLONE = 0x40049409
+
+# Files up to this size are copied by the threads of copytree(threads=N),
+# bigger ones are copied chunk by chunk for a smooth progress
+PARALLEL_MAX_FILE_SIZE = 1024 * 1024
+
+KERNEL_COPY_FUNCTIONS = []
+if hasattr(os, 'copy_file_range'):
+    KERNEL_COPY_FUNCTIONS.append(_copy_file_range)
+if hasattr(os, 'sendfile') and sys.platform.startswith('linux'):
+    # Linux can sendfile() between regular files since 2.6.33
+    KERNEL_COPY_FUNCTIONS.append(_sendfile)
+
 class Error(EnvironmentError):
     pass
 
@@ -24,63 +76,312 @@ class SpecialFileError(EnvironmentError):
     """Raised when trying to do a kind of operation (e.g. copying) which is
     not supported on a special file (e.g. a named pipe)"""
 
+class _Unsupported(Exception):
+    """A kernel copy function can't copy these files, so read and write"""
+
+class Cloned(int):
+    """Yielded instead of an int when a file was cloned with FICLONE"""
+
+class Planned(int):
+    """The size of a file which is going to be copied, see copytree()"""
+
+class Finished(int):
+    """Yielded as a 0 whenever copytree(threads=N) has copied a file"""
+
+class CopyControl(object):
+    """Pauses or cancels the threads of copytree(threads=N).
+
+    The threads keep copying while the generator isn't advanced, so the
+    owner of the generator calls pause() or cancel() from its thread and
+    the threads check it after every chunk.
+
+    """
+    def __init__(self):
+        self.cancelled = False
+        self.pools = []
+        self._running = threading.Event()
+        self._running.set()
+
+    def pause(self):
+        self._running.clear()
+
+    def unpause(self):
+        self._running.set()
+
+    def cancel(self):
+        """Stop copying and drop the files which weren't started yet"""
+        self.cancelled = True
+        for pool in tuple(self.pools):
+            pool.cancel()
+        self._running.set()
+
+    def proceed(self):
+        """Wait while paused.  Returns False once cancelled."""
+        self._running.wait()
+        return not self.cancelled
+
 try:
     WindowsError
 except NameError:
     WindowsError = None
 
-def copyfileobj(fsrc, fdst, length=BLOCK_SIZE):
-    """copy data from file-like object fsrc to file-like object fdst"""
-    while 1:
-        buf = fsrc.read(length)
+def _next_chunk_size(copied, seconds):
+    """The size of a chunk which takes about SECONDS_PER_CHUNK to copy"""
+    if seconds <= 0:
+        size = copied * 4
+    else:
+        size = min(int(copied / seconds * SECONDS_PER_CHUNK), copied * 4)
+    return max(BLOCK_SIZE, min(MAX_CHUNK_SIZE, size))
+
+def _kernel_copy(function, src_fd, dst_fd, offset=0, end=None,
+        throttle=None):
+    """Copy the data with a kernel copy function, yielding after each chunk.
+
+    The data from offset up to end, or to the end of the file if end is
+    None, is copied.  Raises _Unsupported if the function can't copy
+    these files and nothing has been copied yet.
+
+    """
+    first_offset = offset
+    chunk = INITIAL_CHUNK_SIZE
+    while end is None or offset < end:
+        start = time()
+        if throttle is not None:
+            # don't copy in bursts which take long at the limited rate
+            limit = throttle.chunk_size(SECONDS_PER_CHUNK)
+            if limit is not None:
+                chunk = min(chunk, max(BLOCK_SIZE, limit))
+        if end is not None:
+            chunk = min(chunk, end - offset)
+        try:
+            copied = function(src_fd, dst_fd, chunk, offset)
+        except OSError as err:
+            if offset == first_offset and err.errno in _UNSUPPORTED_ERRNOS:
+                raise _Unsupported
+            raise
+        if not copied:
+            if offset == first_offset:
+                # some filesystems (like procfs) claim there's no data
+                raise _Unsupported
+            return
+        offset += copied
+        chunk = _next_chunk_size(copied, time() - start)
+        yield copied
+
+def allocated_size(st):
+    """The number of bytes of a file without its holes, roughly"""
+    blocks = getattr(st, 'st_blocks', None)
+    if blocks is None:
+        return st.st_size
+    return min(st.st_size, blocks * 512)
+
+def _data_segments(fd, st, offset):
+    """The (start, end) tuples of the data of a sparse file after offset.
+
+    Returns None if the file has no holes or the system can't find them.
+
+    """
+    if not hasattr(os, 'SEEK_DATA') or allocated_size(st) >= st.st_size:
+        return None
+    segments = []
+    position = offset
+    while position < st.st_size:
+        try:
+            start = os.lseek(fd, position, os.SEEK_DATA)
+        except OSError as err:
+            if err.errno == errno.ENXIO:
+                break  # there's only a hole after position
+            return None
+        position = min(os.lseek(fd, start, os.SEEK_HOLE), st.st_size)
+        segments.append((start, position))
+    return segments
+
+def _hash_zeros(hasher, count):
+    """Feed the hasher with the zeros of a hole"""
+    zeros = b'\0' * min(count, INITIAL_CHUNK_SIZE)
+    while count > 0:
+        hasher.update(zeros[:count])
+        count -= len(zeros)
+
+def _copy_segment(fsrc, fdst, length, kernel_copy, start, end, throttle,
+        hasher=None):
+    """Copy the data of fsrc from start to end (None for the end of file)"""
+    if start or end is not None:
+        # sendfile() writes at the position of fdst
+        fsrc.seek(start)
+        fdst.seek(start)
+    if kernel_copy and hasher is None:
+        for function in KERNEL_COPY_FUNCTIONS:
+            try:
+                for copied in _kernel_copy(function, fsrc.fileno(),
+                        fdst.fileno(), start, end, throttle):
+                    yield copied
+                return
+            except _Unsupported:
+                pass
+    position = start
+    while end is None or position < end:
+        if end is None:
+            buf = fsrc.read(length)
+        else:
+            buf = fsrc.read(min(length, end - position))
         if not buf:
             break
+        if hasher is not None:
+            hasher.update(buf)
         fdst.write(buf)
-        yield
+        position += len(buf)
+        yield len(buf)
 
-def _samefile(src, dst):
-    # Macintosh, Unix.
-    if hasattr(os.path,'samefile'):
-        try:
-            return os.path.samefile(src, dst)
-        except OSError:
-            return False
+def copyfileobj(fsrc, fdst, length=BLOCK_SIZE, size=None, offset=0,
+        throttle=None, hasher=None):
+    """copy data from file-like object fsrc to file-like object fdst
+
+    With an offset, the first bytes of both files are skipped.  The holes
+    of sparse files are skipped too, so fdst gets the same holes, and only
+    the number of bytes of actual data is yielded.
 
-    # All other platforms: check for same pathname.
-    return (os.path.normcase(abspath(src)) ==
-            os.path.normcase(abspath(dst)))
+    A Throttle (see ranger.ext.throttle) limits the size of the chunks,
+    waiting for it is up to the caller.
 
-def copyfile(src, dst):
-    """Copy data from src to dst"""
-    if _samefile(src, dst):
+    The data after the offset is passed to the hasher, an object of
+    hashlib, if given.  Holes count as zeros.  Since the data has to pass
+    through python for this, it is copied in big chunks instead of using
+    copy_file_range() or sendfile().
+
+    """
+    if hasher is not None:
+        length = max(length, INITIAL_CHUNK_SIZE)
+    segments = None
+    try:
+        src_fd = fsrc.fileno()
+        fdst.fileno()
+        if size is None or size > BLOCK_SIZE:
+            st = os.fstat(src_fd)
+            size = st.st_size
+            segments = _data_segments(src_fd, st, offset)
+    except (AttributeError, EnvironmentError, ValueError):
+        size = 0
+    if segments is None:
+        for copied in _copy_segment(fsrc, fdst, length, size, offset, None,
+                throttle, hasher):
+            yield copied
+        return
+    position = offset
+    for start, end in segments:
+        if hasher is not None:
+            _hash_zeros(hasher, start - position)
+        for copied in _copy_segment(fsrc, fdst, length, True, start, end,
+                throttle, hasher):
+            yield copied
+        position = end
+    if hasher is not None:
+        _hash_zeros(hasher, size - position)
+    fdst.truncate(size)  # the hole at the end
+
+def clonefileobj(fsrc, fdst):
+    """Make fdst share the data of fsrc.  Returns False if impossible"""
+    if fcntl is None:
+        return False
+    try:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    except (IOError, OSError):
+        # e.g. EXDEV, EOPNOTSUPP or EINVAL
+        return False
+    return True
+
+def _stat(path):
+    try:
+        return os.stat(path)
+    except OSError:
+        # File most likely does not exist
+        return None
+
+def copyfile(src, dst, reflink='prefer', src_stat=None, journal=None,
+        throttle=None, checksums=None):
+    """Copy data from src to dst
+
+    With reflink='prefer', the data is shared with a reflink if the
+    filesystem supports it and copied otherwise.  'force' raises an Error
+    if no reflink can be made and 'disable' always copies.
+
+    If the os.stat() of src is known already, pass it as src_stat.
+
+    The progress is recorded in the journal, a CopyJournal, if given.
+    When resuming a journal, complete files are skipped and partial ones
+    are continued, yielding the size of the skipped data first.
+
+    A Throttle limits the rate of copying by sleeping after each chunk.
+
+    With checksums, a ranger.ext.checksums.Checksums object, the data is
+    hashed while it's copied and the result is added to it for verifying
+    the copy later.  Reflinks share the data, so they are left out.
+
+    """
+    if src_stat is None:
+        src_stat = _stat(src)
+    dst_stat = _stat(dst)
+    if src_stat and dst_stat and src_stat.st_ino == dst_stat.st_ino \
+            and src_stat.st_dev == dst_stat.st_dev:
         raise Error("`%s` and `%s` are the same file" % (src, dst))
 
     fsrc = None
     fdst = None
-    for fn in [src, dst]:
-        try:
-            st = os.stat(fn)
-        except OSError:
-            # File most likely does not exist
-            pass
-        else:
-            # XXX What about other special files? (sockets, devices...)
-            if stat.S_ISFIFO(st.st_mode):
-                raise SpecialFileError("`%s` is a named pipe" % fn)
+    for fn, st in ((src, src_stat), (dst, dst_stat)):
+        # XXX What about other special files? (sockets, devices...)
+        if st and stat.S_ISFIFO(st.st_mode):
+            raise SpecialFileError("`%s` is a named pipe" % fn)
+    size = src_stat and src_stat.st_size
+    offset = 0
+    if journal is not None:
+        offset = journal.resume_offset(src, dst, src_stat)
+        if offset is None:
+            if checksums is not None:
+                checksums.add(src, dst, None, src_stat.st_size)
+            yield allocated_size(src_stat)
+            return
+    if checksums is not None and not offset:
+        hasher = checksums.new()
+    else:
+        hasher = None
     try:
         fsrc = open(src, 'rb')
-        fdst = open(dst, 'wb')
-        for _ in copyfileobj(fsrc, fdst):
-            yield
+        if offset:
+            fdst = open(dst, 'r+b')
+            fdst.truncate(offset)
+            yield offset
+        else:
+            fdst = open(dst, 'wb')
+        if reflink != 'disable':
+            if clonefileobj(fsrc, fdst):
+                if size is None:
+                    size = os.fstat(fsrc.fileno()).st_size
+                yield Cloned(size - offset)
+                return
+            if reflink == 'force':
+                raise Error("Cannot reflink `%s` to `%s`" % (src, dst))
+        for copied in copyfileobj(fsrc, fdst, size=size, offset=offset,
+                throttle=throttle, hasher=hasher):
+            offset += copied
+            if journal is not None:
+                journal.progress(dst, offset, src_stat)
+            if throttle is not None:
+                throttle.wait(copied)
+            yield copied
+        if checksums is not None:
+            # without a hasher, the source is hashed when verifying
+            checksums.add(src, dst, hasher and hasher.digest(),
+                    size or os.fstat(fsrc.fileno()).st_size)
     finally:
         if fdst:
             fdst.close()
         if fsrc:
             fsrc.close()
 
-def copystat(src, dst):
+def copystat(src, dst, st=None):
     """Copy all stat info (mode bits, atime, mtime, flags) from src to dst"""
-    st = os.stat(src)
+    if st is None:
+        st = os.stat(src)
     mode = stat.S_IMODE(st.st_mode)
     if hasattr(os, 'utime'):
         try: os.utime(dst, (st.st_atime, st.st_mtime))
@@ -92,7 +393,8 @@ def copystat(src, dst):
         try: os.chflags(dst, st.st_flags)
         except: pass
 
-def copy2(src, dst, overwrite=False, symlinks=False):
+def copy2(src, dst, overwrite=False, symlinks=False, reflink='prefer',
+        src_stat=None, journal=None, throttle=None, checksums=None):
     """Copy data and all stat info ("cp -p src dst").
 
     The destination may be a directory.
@@ -106,26 +408,34 @@ def copy2(src, dst, overwrite=False, symlinks=False):
         linkto = os.readlink(src)
         os.symlink(linkto, dst)
     else:
-        for _ in copyfile(src, dst):
-            yield
-        copystat(src, dst)
-
-def get_safe_path(dst):
-    if not os.path.exists(dst):
+        for copied in copyfile(src, dst, reflink, src_stat, journal,
+                throttle, checksums):
+            yield copied
+        copystat(src, dst, src_stat)
+        if journal is not None:
+            journal.finished(dst)
+
+def get_safe_path(dst, taken=()):
+    """Return a path like dst which doesn't exist yet and isn't in taken"""
+    def exists(path):
+        return path in taken or os.path.exists(path)
+    if not exists(dst):
         return dst
     if not dst.endswith(APPENDIX):
         dst += APPENDIX
-        if not os.path.exists(dst):
+        if not exists(dst):
             return dst
     n = 0
     test_dst = dst + str(n)
-    while os.path.exists(test_dst):
+    while exists(test_dst):
         n += 1
         test_dst = dst + str(n)
 
     return test_dst
 
-def copytree(src, dst, symlinks=False, ignore=None, overwrite=False):
+def copytree(src, dst, symlinks=False, ignore=None, overwrite=False,
+        reflink='prefer', threads=0, journal=None, hardlinks=False,
+        throttle=None, checksums=None, control=None):
     """Recursively copy a directory tree using copy2().
 
     The destination directory must not already exist.
@@ -148,9 +458,61 @@ def copytree(src, dst, symlinks=False, ignore=None, overwrite=False):
     list of names relative to the `src` directory that should
     not be copied.
 
+    With threads >= 1, files are copied while the tree is still being
+    walked, and a Planned int with the size of each file is yielded when
+    it is found.  With threads > 1, small files are copied by that many
+    threads at once, which is a lot faster for many small files,
+    especially on SSDs or network filesystems.
+
+    The journal, the throttle and the checksums are passed on to
+    copyfile().
+
+    With hardlinks=True, files which are hardlinked to each other are
+    copied once and linked in the destination tree too.
+
+    A CopyControl pauses or cancels the threads.  At most twice as many
+    files as there are threads are handed to them at a time.
+
+    The sizes of the files are planned before most of them are copied:
+
+    >>> import tempfile
+    >>> src, dst = tempfile.mkdtemp(), tempfile.mkdtemp()
+    >>> for i in range(10):
+    ...     os.mkdir(os.path.join(src, str(i)))
+    ...     for j in range(50):
+    ...         with open(os.path.join(src, str(i), str(j)), 'wb') as f:
+    ...             _ = f.write(b'x' * 4096)
+    >>> total = 500 * 4096
+    >>> planned = copied = 0
+    >>> planned_at_half = None
+    >>> for n in copytree(src, os.path.join(dst, 'copy'), threads=2):
+    ...     if isinstance(n, Planned):
+    ...         planned += n
+    ...         continue
+    ...     copied += n
+    ...     if planned_at_half is None and copied >= total // 2:
+    ...         planned_at_half = planned
+    >>> copied == total, planned_at_half == planned
+    (True, True)
+    >>> rmtree(src); rmtree(dst)
+
     XXX Consider this example code rather than the ultimate tool.
 
     """
+    if threads >= 1:
+        for copied in _copytree_parallel(src, dst, symlinks, ignore,
+                overwrite, reflink, threads, journal, hardlinks, throttle,
+                checksums, control):
+            yield copied
+        return
+    if hardlinks:
+        # the links are made once the whole tree is copied
+        for copied in _copytree_parallel(src, dst, symlinks, ignore,
+                overwrite, reflink, 1, journal, hardlinks, throttle,
+                checksums, control):
+            if not isinstance(copied, Planned):
+                yield copied
+        return
     names = os.listdir(src)
     if ignore is not None:
         ignored_names = ignore(src, names)
@@ -178,14 +540,16 @@ def copytree(src, dst, symlinks=False, ignore=None, overwrite=False):
                         os.unlink(dstname)
                         os.symlink(linkto, dstname)
             elif os.path.isdir(srcname):
-                for _ in copytree(srcname, dstname, symlinks,
-                        ignore, overwrite):
-                    yield
+                for copied in copytree(srcname, dstname, symlinks,
+                        ignore, overwrite, reflink, journal=journal,
+                        throttle=throttle, checksums=checksums):
+                    yield copied
             else:
                 # Will raise a SpecialFileError for unsupported file types
-                for _ in copy2(srcname, dstname,
-                        overwrite=overwrite, symlinks=symlinks):
-                    yield
+                for copied in copy2(srcname, dstname, overwrite=overwrite,
+                        symlinks=symlinks, reflink=reflink, journal=journal,
+                        throttle=throttle, checksums=checksums):
+                    yield copied
         # catch the Error from the recursive copytree so that we can
         # continue with other files
         except Error as err:
@@ -203,6 +567,269 @@ def copytree(src, dst, symlinks=False, ignore=None, overwrite=False):
     if errors:
         raise Error(errors)
 
+class _FileCopy(object):
+    """A job for the WorkerPool of _copytree_parallel()"""
+    def __init__(self, src, dst, reflink, src_stat, journal=None,
+            throttle=None, checksums=None, control=None):
+        self.src = src
+        self.dst = dst
+        self.reflink = reflink
+        self.src_stat = src_stat
+        self.journal = journal
+        self.throttle = throttle
+        self.checksums = checksums
+        self.control = control
+        self.result = 0
+        self.errors = None
+
+    def run(self):
+        for copied in self.copy():
+            pass
+
+    def copy(self):
+        """Copy the file, yielding like copyfile().  Errors are stored.
+        Stops without an error when the CopyControl is cancelled."""
+        control = self.control
+        if control is not None and not control.proceed():
+            return
+        try:
+            for copied in copyfile(self.src, self.dst, self.reflink,
+                    self.src_stat, self.journal, self.throttle,
+                    self.checksums):
+                if isinstance(copied, Cloned):
+                    self.result = Cloned(self.result + copied)
+                else:
+                    self.result += copied
+                yield copied
+                if control is not None and not control.proceed():
+                    return
+            copystat(self.src, self.dst, self.src_stat)
+            if self.journal is not None:
+                self.journal.finished(self.dst)
+        except Error as err:
+            self.errors = list(err.args[0]) \
+                    if isinstance(err.args[0], list) else [err.args[0]]
+        except EnvironmentError as why:
+            self.errors = [(self.src, self.dst, str(why))]
+
+def _list_dir(path):
+    """Returns a list of (name, DirEntry or None) tuples"""
+    if scandir is None:
+        return [(name, None) for name in os.listdir(path)]
+    return [(entry.name, entry) for entry in scandir(path)]
+
+def _plan_copytree(src, dst, symlinks, ignore, overwrite, files, dirs,
+        errors, taken, inodes=None, links=None):
+    """Create the directories like copytree() and find the files.
+
+    The (src, dst, stat) tuples of files which need copying are appended
+    to files and the (src, dst) tuples of directories to dirs.  Every
+    source file is stat()ed once, and this stat is used for copying it
+    too.  Yields after every directory.
+
+    If inodes is a dict, it maps the (st_dev, st_ino) of files with
+    several hardlinks to their first destination, and the later ones are
+    appended to links as (src, dst, stat, first destination) instead.
+
+    """
+    entries = _list_dir(src)
+    names = [name for name, entry in entries]
+    if ignore is not None:
+        ignored_names = ignore(src, names)
+    else:
+        ignored_names = set()
+
+    try:
+        os.makedirs(dst)
+    except Exception as err:
+        if not overwrite:
+            dst = get_safe_path(dst)
+            os.makedirs(dst)
+    dirs.append((src, dst))
+    yield
+    for name, entry in entries:
+        if name in ignored_names:
+            continue
+        srcname = os.path.join(src, name)
+        dstname = os.path.join(dst, name)
+        try:
+            if entry is None:
+                is_link = symlinks and os.path.islink(srcname)
+            else:
+                is_link = symlinks and entry.is_symlink()
+            if is_link:
+                linkto = os.readlink(srcname)
+                if os.path.lexists(dstname):
+                    if not os.path.islink(dstname) \
+                    or os.readlink(dstname) != linkto:
+                        os.unlink(dstname)
+                        os.symlink(linkto, dstname)
+                continue
+            if entry is None:
+                st = os.stat(srcname)
+            else:
+                st = entry.stat()
+            if stat.S_ISDIR(st.st_mode):
+                for _ in _plan_copytree(srcname, dstname, symlinks, ignore,
+                        overwrite, files, dirs, errors, taken, inodes, links):
+                    yield
+                continue
+            if stat.S_ISFIFO(st.st_mode):
+                raise SpecialFileError("`%s` is a named pipe" % srcname)
+            # The same destination as copy2() would use
+            if os.path.isdir(dstname):
+                dstname = os.path.join(dstname, name)
+            if not overwrite:
+                dstname = get_safe_path(dstname, taken)
+                taken.add(dstname)
+            if inodes is not None and st.st_nlink > 1:
+                inode = (st.st_dev, st.st_ino)
+                if inode in inodes:
+                    links.append((srcname, dstname, st, inodes[inode]))
+                    continue
+                inodes[inode] = dstname
+            files.append((srcname, dstname, st))
+        except Error as err:
+            errors.extend(err.args[0])
+        except EnvironmentError as why:
+            errors.append((srcname, dstname, str(why)))
+
+def _copytree_parallel(src, dst, symlinks, ignore, overwrite, reflink,
+        threads, journal=None, hardlinks=False, throttle=None,
+        checksums=None, control=None):
+    """copytree() which copies files while it's still walking the tree.
+
+    Yields a Planned int with the size of each file when it is found, so
+    the caller can estimate the total size, which is known once the walk
+    is over.  The walk runs ahead of the copying for a part of each time
+    slice, so the total is usually known long before the copy is done.
+    Files of up to PARALLEL_MAX_FILE_SIZE are copied by a pool
+    of threads if threads > 1.  With hardlinks, the further links of a
+    file are made at the end and aren't part of the planned size.
+
+    """
+    files = deque()
+    dirs = []
+    errors = []
+    links = []
+    if hardlinks:
+        inodes = {}
+    else:
+        inodes = None
+    done = Queue()
+    if threads > 1:
+        pool = WorkerPool(threads, on_done=done.put)
+        if control is not None:
+            control.pools.append(pool)
+    else:
+        pool = None
+    pending = 0
+    max_pending = 2 * threads
+    planned = 0     # the number of files whose size was yielded
+    dispatched = 0  # the number of files taken from files
+
+    def finished_jobs(timeout=None):
+        try:
+            while True:
+                if timeout:
+                    job = done.get(timeout=timeout)
+                    timeout = None
+                else:
+                    job = done.get_nowait()
+                if job.errors:
+                    errors.extend(job.errors)
+                yield job
+        except Empty:
+            pass
+
+    planner = _plan_copytree(src, dst, symlinks, ignore, overwrite,
+            files, dirs, errors, set(), inodes, links)
+    planning = True
+    try:
+        while planning or files or pending:
+            if control is not None and control.cancelled:
+                # Some files weren't copied, so don't let move() remove
+                # the source tree
+                raise Error([(src, dst, "cancelled")])
+            if planning:
+                end_time = time() + SECONDS_PER_CHUNK / 2
+                try:
+                    while True:
+                        next(planner)
+                        if time() >= end_time:
+                            break
+                except StopIteration:
+                    planning = False
+                found = dispatched + len(files) - planned
+                for i in range(len(files) - found, len(files)):
+                    yield Planned(allocated_size(files[i][2]))
+                planned += found
+            # Hand only a few files to the threads at a time, which
+            # keep copying while this generator isn't advanced
+            while files and pending < max_pending:
+                srcname, dstname, st = files.popleft()
+                dispatched += 1
+                job = _FileCopy(srcname, dstname, reflink, st, journal,
+                        throttle, checksums, control)
+                if pool is not None and st.st_size <= PARALLEL_MAX_FILE_SIZE:
+                    pool.submit(job)
+                    pending += 1
+                    continue
+                # Copy it right here, while the threads are busy
+                for copied in job.copy():
+                    yield copied
+                    for finished in finished_jobs():
+                        pending -= 1
+                        yield finished.result
+                        yield Finished(0)
+                if job.errors:
+                    errors.extend(job.errors)
+                yield Finished(0)
+            if (planning and pending < max_pending) or not pending:
+                timeout = None
+            else:
+                timeout = SECONDS_PER_CHUNK  # nothing to do but waiting
+            found = False
+            for finished in finished_jobs(timeout):
+                found = True
+                pending -= 1
+                yield finished.result
+                yield Finished(0)
+            if not found:
+                yield 0
+        for srcname, dstname, st, target in links:
+            try:
+                if os.path.lexists(dstname):
+                    os.unlink(dstname)
+                os.link(target, dstname)
+            except OSError:
+                # e.g. too many links, so make a copy after all
+                yield Planned(allocated_size(st))
+                job = _FileCopy(srcname, dstname, reflink, st, journal,
+                        throttle, checksums, control)
+                for copied in job.copy():
+                    yield copied
+                if job.errors:
+                    errors.extend(job.errors)
+            yield Finished(0)
+        if control is not None and control.cancelled:
+            raise Error([(src, dst, "cancelled")])
+    finally:
+        # Don't keep copying when the generator is closed early
+        if pool is not None:
+            pool.cancel()
+            pool.shutdown()
+            if control is not None:
+                control.pools.remove(pool)
+
+    for src, dst in reversed(dirs):
+        try:
+            copystat(src, dst)
+        except OSError as why:
+            errors.append((src, dst, str(why)))
+    if errors:
+        raise Error(errors)
+
 def rmtree(path, ignore_errors=False, onerror=None):
     """Recursively delete a directory tree.
 
@@ -257,7 +884,9 @@ def _basename(path):
     # Thus we always get the last component of the path, even for directories.
     return os.path.basename(path.rstrip(os.path.sep))
 
-def move(src, dst, overwrite=False):
+def move(src, dst, overwrite=False, reflink='prefer', threads=0,
+        hardlinks=False, throttle=None, checksums=None, control=None,
+        removals=None):
     """Recursively move a file or directory to another location. This is
     similar to the Unix "mv" command.
 
@@ -273,6 +902,14 @@ def move(src, dst, overwrite=False):
     A lot more could be done here...  A look at a mv.c shows a lot of
     the issues this implementation glosses over.
 
+    When copying with threads >= 1, Planned ints are yielded like in
+    copytree().  Files which are hardlinked to each other within a copied
+    tree become separate files, unless hardlinks=True, like the setting
+    preserve_hardlinks, which is off by default.
+
+    If removals is a list, a copied src is appended to it instead of being
+    removed, so it can be removed once the copy has been verified.
+
     """
     real_dst = os.path.join(dst, _basename(src))
     if not overwrite:
@@ -283,13 +920,29 @@ def move(src, dst, overwrite=False):
         if os.path.isdir(src):
             if _destinsrc(src, dst):
                 raise Error("Cannot move a directory '%s' into itself '%s'." % (src, dst))
-            for _ in copytree(src, real_dst, symlinks=True, overwrite=overwrite):
-                yield
-            rmtree(src)
+            for copied in copytree(src, real_dst, symlinks=True,
+                    overwrite=overwrite, reflink=reflink, threads=threads,
+                    hardlinks=hardlinks, throttle=throttle,
+                    checksums=checksums, control=control):
+                yield copied
+            if removals is not None:
+                removals.append(src)
+            else:
+                rmtree(src)
         else:
-            for _ in copy2(src, real_dst, symlinks=True, overwrite=overwrite):
-                yield
-            os.unlink(src)
+            src_stat = os.lstat(src)
+            if stat.S_ISLNK(src_stat.st_mode):
+                src_stat = None
+            elif threads >= 1:
+                yield Planned(allocated_size(src_stat))
+            for copied in copy2(src, real_dst, symlinks=True,
+                    overwrite=overwrite, reflink=reflink, src_stat=src_stat,
+                    throttle=throttle, checksums=checksums):
+                yield copied
+            if removals is not None:
+                removals.append(src)
+            else:
+                os.unlink(src)
 
 def _destinsrc(src, dst):
     src = abspath(src)
@@ -300,4 +953,8 @@ def _destinsrc(src, dst):
         dst += os.path.sep
     return dst.startswith(src)
 
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
+
 # vi: expandtab sts=4 ts=4 sw=4
@@ -0,0 +1,66 @@
+# Copyright (C) 2009, 2010, 2011  Roman Zimbelmann <romanz@lavabit.com>
+# This software is distributed under the terms of the GNU GPL version 3.
+
+"""
+Limit the rate of something, like the bytes per second of a copy job.
+
+A Throttle may be shared by several threads.  After doing some work,
+each of them calls wait() with its amount, which sleeps as long as the
+work was ahead of the rate.  The rate can be changed at any time and 0
+means unlimited.
+
+>>> from time import time
+>>> throttle = Throttle(1000)
+>>> start = time()
+>>> for i in range(5):
+... 	throttle.wait(100)
+>>> 0.3 < time() - start < 1
+True
+>>> throttle.rate = 0
+>>> throttle.wait(10 ** 9)
+>>> throttle.chunk_size(0.1) is None
+True
+"""
+
+import threading
+from time import time, sleep
+
+class Throttle(object):
+	burst = 0.1  # seconds of work which may be done ahead of the rate
+
+	def __init__(self, rate=0):
+		self.lock = threading.Lock()
+		self.rate = rate
+
+	def _get_rate(self):
+		return self._rate
+
+	def _set_rate(self, rate):
+		with self.lock:
+			self._rate = max(0, rate)
+			self.clock = time()
+
+	rate = property(_get_rate, _set_rate)
+
+	def chunk_size(self, seconds):
+		"""The amount which fits in that many seconds, or None if unlimited"""
+		rate = self._rate
+		if not rate:
+			return None
+		return max(1, int(rate * seconds))
+
+	def wait(self, amount):
+		"""Account for the amount and sleep if it came too early"""
+		with self.lock:
+			rate = self._rate
+			if not rate:
+				return
+			now = time()
+			self.clock = max(self.clock, now - self.burst) + amount / float(rate)
+			delay = self.clock - now
+		if delay > 0:
+			sleep(delay)
+
+if __name__ == '__main__':
+	import doctest
+	doctest.testmod()
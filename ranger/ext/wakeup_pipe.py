@@ -0,0 +1,65 @@
+# Copyright (C) 2009, 2010, 2011  Roman Zimbelmann <romanz@lavabit.com>
+# This software is distributed under the terms of the GNU GPL version 3.
+
+"""
+A pipe which wakes up a select() call, e.g. from another thread.
+
+>>> import select
+>>> pipe = WakeupPipe()
+>>> select.select([pipe], [], [], 0)[0]
+[]
+>>> pipe.wake()
+>>> pipe.wake()
+>>> select.select([pipe], [], [], 0)[0] == [pipe]
+True
+>>> pipe.clear()
+>>> select.select([pipe], [], [], 0)[0]
+[]
+>>> pipe.close()
+"""
+
+import os
+import fcntl
+from errno import EAGAIN, EINTR
+
+def _set_flags(fd):
+	fcntl.fcntl(fd, fcntl.F_SETFL,
+			fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+	fcntl.fcntl(fd, fcntl.F_SETFD,
+			fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+
+class WakeupPipe(object):
+	def __init__(self):
+		self.read_fd, self.write_fd = os.pipe()
+		_set_flags(self.read_fd)
+		_set_flags(self.write_fd)
+
+	def fileno(self):
+		return self.read_fd
+
+	def wake(self):
+		"""Make the read end readable.  Safe to call from any thread"""
+		try:
+			os.write(self.write_fd, b'\0')
+		except OSError:
+			pass  # the pipe is full, so it's readable anyway
+
+	def clear(self):
+		"""Read everything, so select() blocks again"""
+		while True:
+			try:
+				if not os.read(self.read_fd, 4096):
+					return
+			except OSError as err:
+				if err.errno != EINTR:
+					return
+
+	def close(self):
+		if self.read_fd >= 0:
+			os.close(self.read_fd)
+			os.close(self.write_fd)
+			self.read_fd = self.write_fd = -1
+
+if __name__ == '__main__':
+	import doctest
+	doctest.testmod()
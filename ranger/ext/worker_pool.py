@@ -0,0 +1,77 @@
+# Copyright (C) 2009, 2010, 2011  Roman Zimbelmann <romanz@lavabit.com>
+# This software is distributed under the terms of the GNU GPL version 3.
+
+"""
+A bounded pool of worker threads.
+
+Jobs are objects with a run() method.  After a job has run, the on_done
+callback is called with it, still inside the worker thread.
+
+>>> try:
+... 	from queue import Queue
+... except ImportError:
+... 	from Queue import Queue
+>>> class Job(object):
+... 	def __init__(self, n):
+... 		self.n = n
+... 	def run(self):
+... 		self.result = self.n * 2
+>>> done = Queue()
+>>> pool = WorkerPool(2, on_done=done.put)
+>>> for n in range(5):
+... 	pool.submit(Job(n))
+>>> sorted(done.get(timeout=5).result for n in range(5))
+[0, 2, 4, 6, 8]
+>>> len(pool.threads)
+2
+>>> pool.shutdown()
+"""
+
+import threading
+try:
+	from queue import Queue, Empty
+except ImportError:
+	from Queue import Queue, Empty
+
+class WorkerPool(object):
+	def __init__(self, size, on_done=None):
+		self.size = max(1, size)
+		self.on_done = on_done
+		self.jobs = Queue()
+		self.threads = []
+
+	def submit(self, job):
+		"""Queue the job, starting another thread if the limit allows it"""
+		self.jobs.put(job)
+		if len(self.threads) < self.size:
+			thread = threading.Thread(target=self._work)
+			thread.daemon = True  # don't wait for jobs hanging on e.g. NFS
+			self.threads.append(thread)
+			thread.start()
+
+	def cancel(self):
+		"""Drop the jobs which haven't been started yet"""
+		try:
+			while True:
+				self.jobs.get_nowait()
+		except Empty:
+			pass
+
+	def shutdown(self):
+		"""Stop the threads once they have finished their current job"""
+		for _ in self.threads:
+			self.jobs.put(None)
+		self.threads = []
+
+	def _work(self):
+		while True:
+			job = self.jobs.get()
+			if job is None:
+				return
+			job.run()
+			if self.on_done is not None:
+				self.on_done(job)
+
+if __name__ == '__main__':
+	import doctest
+	doctest.testmod()
@@ -6,10 +6,15 @@ import re
 
 from os import stat as os_stat, lstat as os_lstat
 from collections import deque
+try:
+	from os import scandir
+except ImportError:
+	scandir = None
 from time import time
 
 from ranger.fsobject import BAD_INFO
-from ranger.core.loader import Loadable
+from ranger.core.loader import Loadable, BlockingCall, exhaust, \
+		PRIORITY_CURRENT, PRIORITY_PARENT, PRIORITY_PREVIEW, PRIORITY_STALE
 from ranger.ext.mount_path import mount_path
 from ranger.fsobject import File, FileSystemObject
 from ranger.core.shared import SettingsAware
@@ -36,6 +41,44 @@ def sort_naturally(path):
 def sort_naturally_icase(path):
 	return path.basename_natural_lower
 
+# How many files are stat()ed in one BlockingCall
+STAT_CHUNK_SIZE = 256
+
+def _scan(path):
+	"""
+	Get the mount point, mtime and listing of a directory.  The listing
+	is a list of DirEntries, or None if scandir is unavailable, and a list
+	of the names.  This runs in a worker thread of the loader.
+	"""
+	mtime = os_stat(path).st_mtime
+	if scandir is None:
+		return mount_path(path), mtime, None, os.listdir(path)
+	entries = list(scandir(path))
+	for entry in entries:
+		try:
+			entry.is_dir()  # this is cached, do the stat of symlinks now
+		except OSError:
+			pass
+	return mount_path(path), mtime, entries, [entry.name for entry in entries]
+
+def _stat_paths(paths):
+	"""
+	Returns a list of (stat, lstat) tuples, usable as preload for
+	FileSystemObjects, or None where the stat failed.
+	"""
+	result = []
+	for path in paths:
+		try:
+			file_lstat = os_lstat(path)
+			if file_lstat.st_mode & 0o170000 == 0o120000:
+				file_stat = os_stat(path)
+			else:
+				file_stat = file_lstat
+			result.append((file_stat, file_lstat))
+		except:
+			result.append(None)
+	return result
+
 def accept_file(fname, dirname, hidden_filter, name_filter):
 	if hidden_filter:
 		try:
@@ -55,6 +98,7 @@ class Directory(FileSystemObject, Accumulator, Loadable, SettingsAware):
 	cycle_list = None
 	loading = False
 	progressbar_supported = True
+	cancel_when_stale = True
 
 	filenames = None
 	files = None
@@ -71,6 +115,8 @@ class Directory(FileSystemObject, Accumulator, Loadable, SettingsAware):
 	order_outdated = False
 	content_outdated = False
 	content_loaded = False
+	watched = False  # if True, the Watcher sets content_outdated for us
+	changed_names = None  # names of files the Watcher saw change, or None
 
 	_cumulative_size_calculated = False
 
@@ -92,6 +138,7 @@ class Directory(FileSystemObject, Accumulator, Loadable, SettingsAware):
 		FileSystemObject.__init__(self, path, **kw)
 
 		self.marked_items = list()
+		self.stats_loading = set()  # paths which load_stats() is loading
 
 		for opt in ('sort_directories_first', 'sort', 'sort_reverse',
 				'sort_case_insensitive'):
@@ -164,6 +211,17 @@ class Directory(FileSystemObject, Accumulator, Loadable, SettingsAware):
 		else:
 			return []
 
+	def _get_hidden_filter(self):
+		if not self.settings.show_hidden and self.settings.hidden_filter:
+			# COMPAT
+			# hidden_filter used to be a regex, not a string.  If an
+			# old config is used, we don't need to re.compile it.
+			if hasattr(self.settings.hidden_filter, 'search'):
+				return self.settings.hidden_filter
+			else:
+				return re.compile(self.settings.hidden_filter)
+		return None
+
 	# XXX: Check for possible race conditions
 	def load_bit_by_bit(self):
 		"""
@@ -180,20 +238,16 @@ class Directory(FileSystemObject, Accumulator, Loadable, SettingsAware):
 				yield
 				mypath = self.path
 
-				self.mount_path = mount_path(mypath)
+				hidden_filter = self._get_hidden_filter()
 
-				if not self.settings.show_hidden and self.settings.hidden_filter:
-					# COMPAT
-					# hidden_filter used to be a regex, not a string.  If an
-					# old config is used, we don't need to re.compile it.
-					if hasattr(self.settings.hidden_filter, 'search'):
-						hidden_filter = self.settings.hidden_filter
-					else:
-						hidden_filter = re.compile(self.settings.hidden_filter)
-				else:
-					hidden_filter = None
+				# Events which arrive from now on are for the next reload
+				changed_names = self.changed_names
+				self.changed_names = set()
 
-				filelist = os.listdir(mypath)
+				# With scandir, we learn the file types without an lstat()
+				# per entry, so the stat can be deferred.
+				self.mount_path, mtime, entries, filelist = \
+						yield BlockingCall(_scan, mypath)
 
 				if self._cumulative_size_calculated:
 					# If self.content_loaded is true, this is not the first
@@ -213,60 +267,135 @@ class Directory(FileSystemObject, Accumulator, Loadable, SettingsAware):
 				if self.is_link:
 					self.infostring = '->' + self.infostring
 
-				filenames = [mypath + (mypath == '/' and fname or '/' + fname)\
-						for fname in filelist if accept_file(
-							fname, mypath, hidden_filter, self.filter)]
+				if entries is None:
+					filenames = [mypath + (mypath == '/' and fname or '/' + fname)\
+							for fname in filelist if accept_file(
+								fname, mypath, hidden_filter, self.filter)]
+				else:
+					entries = [entry for entry in entries if accept_file(
+							entry.name, mypath, hidden_filter, self.filter)]
+					filenames = [entry.path for entry in entries]
 				yield
 
-				self.load_content_mtime = os.stat(mypath).st_mtime
+				self.load_content_mtime = mtime
 
 				marked_paths = [obj.path for obj in self.marked_items]
 
+				# On a reload, keep the objects of unchanged files and
+				# only create the ones which are new or have changed.
+				incremental = self.files is not None and self.content_loaded \
+						and self.settings.incremental_reload
+				if incremental:
+					old_files = dict((f.path, f) for f in self.files)
+				else:
+					old_files = {}
+
 				files = []
-				disk_usage = 0
-				for name in filenames:
-					try:
-						file_lstat = os_lstat(name)
-						if file_lstat.st_mode & 0o170000 == 0o120000:
-							file_stat = os_stat(name)
+				new_files = []  # created or changed objects
+				if entries is None:
+					all_stats = []
+					for i in range(0, len(filenames), STAT_CHUNK_SIZE):
+						all_stats.extend((yield BlockingCall(_stat_paths,
+								filenames[i:i + STAT_CHUNK_SIZE])))
+					for name, stats in zip(filenames, all_stats):
+						is_a_dir = stats is not None and \
+								stats[0].st_mode & 0o170000 == 0o040000
+						item = old_files.get(name)
+						if item is not None and item.is_directory == is_a_dir \
+								and stats and item.stat:
+							if item.stat.st_ctime != stats[0].st_ctime:
+								item.preload = stats
+								item.load()
+								new_files.append(item)
+						elif is_a_dir:
+							try:
+								item = self.fm.get_directory(name)
+								item.load_if_outdated()
+							except:
+								item = Directory(name, preload=stats,
+										path_is_abs=True)
+								item.load()
+							new_files.append(item)
 						else:
-							file_stat = file_lstat
-						stats = (file_stat, file_lstat)
-						is_a_dir = file_stat.st_mode & 0o170000 == 0o040000
-					except:
-						stats = None
-						is_a_dir = False
-					if is_a_dir:
-						try:
-							item = self.fm.get_directory(name)
-							item.load_if_outdated()
-						except:
-							item = Directory(name, preload=stats,
-									path_is_abs=True)
+							item = File(name, preload=stats, path_is_abs=True)
 							item.load()
-					else:
-						item = File(name, preload=stats, path_is_abs=True)
-						item.load()
-						disk_usage += item.size
-					files.append(item)
-					self.percent = 100 * len(files) // len(filenames)
-					yield
-				self.disk_usage = disk_usage
+							new_files.append(item)
+						files.append(item)
+						self.percent = 100 * len(files) // len(filenames)
+						yield
+				else:
+					# Check whether the files which we already stat()ed have
+					# changed.  Objects with deferred stats are up to date.
+					# If the Watcher takes care of us, only the files which
+					# were named by its events can have changed.
+					recheck = [entry.path for entry in entries
+							if entry.path in old_files
+							and old_files[entry.path].loaded]
+					if self.watched and changed_names is not None:
+						recheck = [path for path in recheck
+								if path.rsplit('/', 1)[-1] in changed_names]
+					fresh_stats = {}
+					for i in range(0, len(recheck), STAT_CHUNK_SIZE):
+						chunk = recheck[i:i + STAT_CHUNK_SIZE]
+						fresh_stats.update(zip(chunk,
+								(yield BlockingCall(_stat_paths, chunk))))
+
+					for entry in entries:
+						name = entry.path
+						try:
+							is_a_dir = entry.is_dir()
+							is_a_link = entry.is_symlink()
+						except OSError:
+							is_a_dir = is_a_link = False
+						item = old_files.get(name)
+						if item is not None and item.is_directory == is_a_dir:
+							stats = fresh_stats.get(name)
+							if stats and (not item.stat or
+									item.stat.st_ctime != stats[0].st_ctime
+									or item.stat.st_ino != stats[0].st_ino):
+								item.preload = stats
+								item.load()
+								new_files.append(item)
+						elif is_a_dir:
+							try:
+								item = self.fm.get_directory(name)
+							except:
+								item = Directory(name, path_is_abs=True)
+							if item.loaded:
+								item.load_if_outdated()
+							else:
+								item.load_deferred(is_link=is_a_link)
+							new_files.append(item)
+						else:
+							item = File(name, path_is_abs=True)
+							item.load_deferred(is_link=is_a_link)
+							new_files.append(item)
+						files.append(item)
+						self.percent = 100 * len(files) // len(filenames)
+						yield
 
-				self.filenames = filenames
-				self.files = files
+				for item in new_files:
+					item._mark(item.path in marked_paths)
 
-				self._clear_marked_items()
-				for item in self.files:
-					if item.path in marked_paths:
-						item._mark(True)
-						self.marked_items.append(item)
-					else:
-						item._mark(False)
+				self.filenames = filenames
+				if incremental and not self.order_outdated \
+						and len(new_files) <= len(files) // 4:
+					# Drop removed and changed files from the sorted list
+					# and insert them at their sorted positions, which
+					# is cheaper than sorting everything again.
+					unchanged = set(id(item) for item in files)
+					unchanged.difference_update(id(item) for item in new_files)
+					self.files = [f for f in self.files if id(f) in unchanged]
+					for item in new_files:
+						self._insert_sorted(item)
+				else:
+					self.files = files
+					self.sort()
 
-				self.sort()
+				self.marked_items[:] = [f for f in self.files if f.marked]
+				self.disk_usage = 0
 
-				if files:
+				if self.files:
 					if self.pointed_obj is not None:
 						self.sync_index()
 					else:
@@ -280,13 +409,69 @@ class Directory(FileSystemObject, Accumulator, Loadable, SettingsAware):
 			self.last_update_time = time()
 			self.correct_pointer()
 
+			# The deferred stats are left to load_stats(), which adds
+			# the sizes of the files once they're visible
+			self.disk_usage = self._loaded_disk_usage()
+
 		finally:
 			self.loading = False
 			self.fm.signal_emit("finished_loading_dir", directory=self)
 
+	def _loaded_disk_usage(self):
+		"""The sum of the sizes of the files which were stat()ed already"""
+		if not self.files:
+			return 0
+		return sum(f.size for f in self.files
+				if not f.is_directory and not f.stat_deferred)
+
+	def load_stats(self, files):
+		"""
+		Stat the files whose stat was deferred, like the visible ones, in a
+		worker thread.  The directory is redrawn once they're loaded.
+		"""
+		files = [f for f in files if f.stat_deferred
+				and f.path not in self.stats_loading]
+		if not files:
+			return
+		self.stats_loading.update(f.path for f in files)
+		if self.fm:
+			self.fm.loader.add(_StatLoader(self, files))
+		else:
+			exhaust(self._load_stats(files))
+
+	def _load_stats(self, files):
+		try:
+			for i in range(0, len(files), STAT_CHUNK_SIZE):
+				chunk = files[i:i + STAT_CHUNK_SIZE]
+				all_stats = yield BlockingCall(_stat_paths,
+						[f.path for f in chunk])
+				for item, stats in zip(chunk, all_stats):
+					if item.stat_deferred:
+						# Without stats, load() finds out that it's gone
+						item.preload = stats
+						item.load()
+		finally:
+			self.stats_loading.difference_update(f.path for f in files)
+		self.disk_usage = self._loaded_disk_usage()
+		self.last_update_time = time()
+
 	def unload(self):
 		self.loading = False
 		self.load_generator = None
+		self.content_outdated = True  # finish the interrupted load later
+
+	def get_priority(self):
+		"""Directories are loaded in the order in which they are visible"""
+		thistab = self.fm.thistab
+		if self == thistab.thisdir:
+			return PRIORITY_CURRENT
+		if self in thistab.pathway:
+			return PRIORITY_PARENT
+		for tab in self.fm.tabs.values():
+			if self in tab.pathway or (tab.thisfile is not None
+					and tab.thisfile.path == self.path):
+				return PRIORITY_PREVIEW
+		return PRIORITY_STALE
 
 	def load_content(self, schedule=None):
 		"""
@@ -312,22 +497,15 @@ class Directory(FileSystemObject, Accumulator, Loadable, SettingsAware):
 				if schedule and self.fm:
 					self.fm.loader.add(self)
 				else:
-					for _ in self.load_generator:
-						pass
+					exhaust(self.load_generator)
 					self.load_generator = None
 
 			elif not schedule or not self.fm:
-				for _ in self.load_generator:
-					pass
+				exhaust(self.load_generator)
 				self.load_generator = None
 
 
-	def sort(self):
-		"""Sort the containing files"""
-		if self.files is None:
-			return
-
-		old_pointed_obj = self.pointed_obj
+	def _get_sort_func(self):
 		try:
 			sort_func = self.sort_dict[self.settings.sort]
 		except:
@@ -341,6 +519,16 @@ class Directory(FileSystemObject, Accumulator, Loadable, SettingsAware):
 				sort_func == sort_naturally:
 			sort_func = sort_naturally_icase
 
+		return sort_func
+
+	def sort(self):
+		"""Sort the containing files"""
+		if self.files is None:
+			return
+
+		old_pointed_obj = self.pointed_obj
+		sort_func = self._get_sort_func()
+
 		self.files.sort(key = sort_func)
 
 		if self.settings.sort_reverse:
@@ -354,6 +542,128 @@ class Directory(FileSystemObject, Accumulator, Loadable, SettingsAware):
 		else:
 			self.correct_pointer()
 
+	def _insert_sorted(self, item):
+		"""
+		Insert the item into the already sorted list of files,
+		at the position where sort() would put it
+		"""
+		sort_func = self._get_sort_func()
+		reverse = self.settings.sort_reverse
+		dirs_first = self.settings.sort_directories_first
+		key = sort_func(item)
+		files = self.files
+		low, high = 0, len(files)
+		while low < high:
+			middle = (low + high) // 2
+			other = files[middle]
+			if dirs_first and other.is_directory != item.is_directory:
+				before = other.is_directory
+			elif reverse:
+				before = not sort_func(other) < key
+			else:
+				before = not key < sort_func(other)
+			if before:
+				low = middle + 1
+			else:
+				high = middle
+		files.insert(low, item)
+
+	def apply_renames(self, renames):
+		"""
+		Update the listing after files in it were renamed, without loading
+		it again.  renames is a dict of {old path: new path}.
+
+		Returns False if that wasn't possible, e.g. because a file was
+		moved to another directory, and the listing is marked outdated.
+
+		>>> import tempfile
+		>>> from ranger.core.shared import SettingsAware
+		>>> SettingsAware._setup()
+		>>> root = tempfile.mkdtemp()
+		>>> os.mkdir(os.path.join(root, 'sub'))
+		>>> open(os.path.join(root, 'sub', 'b'), 'w').close()
+		>>> sub = Directory(os.path.join(root, 'sub'))
+		>>> sub.files = [File(os.path.join(root, 'sub', 'b'))]
+		>>> sub.content_loaded = True
+		>>> os.rename(os.path.join(root, 'sub', 'b'),
+		... 		os.path.join(root, 'sub', 'c'))
+		>>> sub.apply_renames({os.path.join(root, 'sub', 'b'):
+		... 		os.path.join(root, 'sub', 'c')})
+		True
+		>>> [item.basename for item in sub.files]
+		['c']
+
+		A file which was moved in from another directory isn't listed yet:
+
+		>>> open(os.path.join(root, 'a'), 'w').close()
+		>>> os.rename(os.path.join(root, 'a'), os.path.join(root, 'sub', 'a'))
+		>>> sub.apply_renames({os.path.join(root, 'a'):
+		... 		os.path.join(root, 'sub', 'a')})
+		False
+		>>> sub.content_outdated
+		True
+		>>> import shutil; shutil.rmtree(root)
+		"""
+		if self.files is None or not self.content_loaded:
+			return False
+		hidden_filter = self._get_hidden_filter()
+		# A file which comes from another directory, or which wasn't
+		# listed, like a hidden one, has no item which could be renamed
+		paths = set(item.path for item in self.files)
+		for old_path, new_path in renames.items():
+			dirname, basename = os.path.split(new_path)
+			if dirname == self.path and old_path not in paths \
+					and accept_file(basename, dirname, hidden_filter,
+						self.filter):
+				self.content_outdated = True
+				return False
+		pointed_obj = self.pointed_obj
+		files = []
+		renamed = []
+		for item in self.files:
+			new_path = renames.get(item.path)
+			if new_path is None:
+				files.append(item)
+				continue
+			dirname, basename = os.path.split(new_path)
+			if dirname != self.path or not accept_file(basename,
+					dirname, hidden_filter, self.filter):
+				self.content_outdated = True
+				return False
+			if item.is_directory:
+				try:
+					new_item = self.fm.get_directory(new_path)
+				except:
+					new_item = Directory(new_path, path_is_abs=True)
+			else:
+				new_item = File(new_path, path_is_abs=True)
+			if not new_item.loaded:
+				new_item.load_deferred(is_link=item.is_link)
+			new_item._mark(item.marked)
+			if item is pointed_obj:
+				pointed_obj = new_item
+			renamed.append(new_item)
+
+		if len(renamed) <= len(files) // 4 and not self.order_outdated:
+			self.files = files
+			for item in renamed:
+				self._insert_sorted(item)
+		else:
+			self.files = files + renamed
+			self.pointed_obj = None
+			self.sort()
+		self.filenames = [item.path for item in self.files]
+		self.marked_items[:] = [item for item in self.files if item.marked]
+		self.cycle_list = None
+		self.move_to_obj(pointed_obj)
+
+		self.last_update_time = time()
+		try:
+			self.load_content_mtime = os.stat(self.path).st_mtime
+		except OSError:
+			self.content_outdated = True
+		return True
+
 	def _get_cumulative_size(self):
 		if self.size == 0:
 			return 0
@@ -487,6 +797,9 @@ class Directory(FileSystemObject, Accumulator, Loadable, SettingsAware):
 			self.load_content(*a, **k)
 			return True
 
+		if self.watched:
+			return False
+
 		try:
 			real_mtime = os.stat(self.path).st_mtime
 		except OSError:
@@ -547,3 +860,21 @@ class Directory(FileSystemObject, Accumulator, Loadable, SettingsAware):
 
 	def __hash__(self):
 		return hash(self.path)
+
+
+class _StatLoader(Loadable):
+	"""Loads the deferred stats of files for Directory.load_stats()"""
+	cancel_when_stale = True
+	silent = True  # it's started by drawing, not by the user
+
+	def __init__(self, directory, files):
+		self.directory = directory
+		Loadable.__init__(self, directory._load_stats(files),
+				"Loading the stats of " + directory.path)
+
+	def get_priority(self):
+		return self.directory.get_priority()
+
+if __name__ == '__main__':
+	import doctest
+	doctest.testmod()
@@ -30,28 +30,40 @@ _extract_number_re = re.compile(r'([^0-9]?)(\d*)')
 def safe_path(path):
 	return path.translate(_safe_string_table)
 
+class _stat_attribute(object):
+	"""
+	An attribute which is derived from the stat() of a FileSystemObject.
+
+	If the object was set up with load_deferred(), reading the attribute
+	triggers the postponed load(), otherwise the default value is returned.
+	"""
+	def __init__(self, name, default):
+		self.__name__ = name
+		self.default = default
+
+	def __get__(self, obj, cls=None):
+		if obj is None:  # to fix issues with pydoc
+			return self.default
+		if obj.__dict__.pop('_stat_deferred', False):
+			obj.load()
+			return getattr(obj, self.__name__)
+		return self.default
+
 class FileSystemObject(FileManagerAware):
 	(basename,
 	basename_lower,
 	dirname,
 	extension,
-	infostring,
 	path,
-	permissions,
-	stat) = (None,) * 8
+	permissions) = (None,) * 6
 
 	(content_loaded,
 	force_load,
 
-	is_device,
 	is_directory,
 	is_file,
-	is_fifo,
 	is_link,
-	is_socket,
 
-	accessible,
-	exists,       # "exists" currently means "link_target_exists"
 	loaded,
 	marked,
 	runnable,
@@ -63,9 +75,16 @@ class FileSystemObject(FileManagerAware):
 	document,
 	image,
 	media,
-	video) = (False,) * 21
+	video) = (False,) * 16
 
-	size = 0
+	stat       = _stat_attribute('stat', None)
+	infostring = _stat_attribute('infostring', None)
+	size       = _stat_attribute('size', 0)
+	accessible = _stat_attribute('accessible', False)
+	exists     = _stat_attribute('exists', False)  # means "link_target_exists"
+	is_device  = _stat_attribute('is_device', False)
+	is_fifo    = _stat_attribute('is_fifo', False)
+	is_socket  = _stat_attribute('is_socket', False)
 
 
 	def __init__(self, path, preload=None, path_is_abs=False):
@@ -194,6 +213,7 @@ class FileSystemObject(FileManagerAware):
 		self.display_data = {}
 		self.fm.update_preview(self.path)
 		self.loaded = True
+		self._stat_deferred = False
 
 		# Get the stat object, either from preload or from [l]stat
 		self.permissions = None
@@ -249,6 +269,25 @@ class FileSystemObject(FileManagerAware):
 
 		self.stat = new_stat
 
+	@property
+	def stat_deferred(self):
+		"""Is the stat() which load_deferred() postponed still missing?"""
+		return self.__dict__.get('_stat_deferred', False)
+
+	def load_deferred(self, is_link=False):
+		"""
+		Prepare the object without touching the filesystem.
+
+		The stat() which load() would do is postponed until an attribute
+		depending on it, like size, stat or infostring, is accessed.  This
+		is used when the file type is already known, e.g. from os.scandir().
+		"""
+		self.display_data = {}
+		self.loaded = False
+		if is_link:
+			self.is_link = True
+		self._stat_deferred = True
+
 	def get_permission_string(self):
 		if self.permissions is not None:
 			return self.permissions
@@ -281,6 +320,8 @@ class FileSystemObject(FileManagerAware):
 		if not self.loaded:
 			self.load()
 			return True
+		if self.dirname in self.fm.watcher.watched_paths:
+			return False  # the Watcher reloads us when we change
 		try:
 			real_ctime = lstat(self.path).st_ctime
 		except OSError:
@@ -5,6 +5,13 @@ import os
 import sys
 import curses
 import _curses
+import signal
+import struct
+try:
+	import fcntl
+	import termios
+except ImportError:
+	fcntl = termios = None
 
 from .displayable import DisplayableContainer
 from .mouse_event import MouseEvent
@@ -31,11 +38,22 @@ def _setup_mouse(signal):
 	else:
 		curses.mousemask(0)
 
+def _resize_curses():
+	"""Tell curses about a new terminal size"""
+	if fcntl is None or not hasattr(curses, 'resizeterm'):
+		return
+	try:
+		rows, cols = struct.unpack('hh', fcntl.ioctl(sys.__stdout__.fileno(),
+				termios.TIOCGWINSZ, b'\0' * 4))
+		if rows > 0 and cols > 0 and curses.is_term_resized(rows, cols):
+			curses.resizeterm(rows, cols)
+	except (IOError, OSError, ValueError, struct.error, _curses.error):
+		pass
+
 # TODO: progress bar
 # TODO: branch view
 class UI(DisplayableContainer):
 	is_set_up = False
-	load_mode = False
 	is_on = False
 	termsize = None
 
@@ -61,11 +79,14 @@ class UI(DisplayableContainer):
 		"""initialize curses, then call setup (at the first time) and resize."""
 		self.win.leaveok(0)
 		self.win.keypad(1)
-		self.load_mode = False
 
 		curses.cbreak()
 		curses.noecho()
-		curses.halfdelay(20)
+		# Never block in getch().  The main loop waits with select() for
+		# input, so it can wait for the loader at the same time.
+		self.win.nodelay(1)
+		if hasattr(signal, 'SIGWINCH'):
+			signal.signal(signal.SIGWINCH, self._resize_handler)
 		try:
 			curses.curs_set(int(bool(self.settings.show_cursor)))
 		except:
@@ -100,19 +121,6 @@ class UI(DisplayableContainer):
 		curses.endwin()
 		self.is_on = False
 
-	def set_load_mode(self, boolean):
-		boolean = bool(boolean)
-		if boolean != self.load_mode:
-			self.load_mode = boolean
-
-			if boolean:
-				# don't wait for key presses in the load mode
-				curses.cbreak()
-				self.win.nodelay(1)
-			else:
-				self.win.nodelay(0)
-				curses.halfdelay(20)
-
 	def destroy(self):
 		"""Destroy all widgets and turn off curses"""
 		self.suspend()
@@ -166,13 +174,18 @@ class UI(DisplayableContainer):
 		for key in keys:
 			self.handle_key(key)
 
+	def _resize_handler(self, signum, frame):
+		# ncurses has its own handler for this, but it couldn't interrupt
+		# the select() in the main loop
+		if self.is_on:
+			curses.ungetch(curses.KEY_RESIZE)
+
 	def handle_input(self):
+		"""Handle the next key press, if any.  Returns False otherwise"""
 		key = self.win.getch()
 		if key is 27 or key >= 128 and key < 256:
 			# Handle special keys like ALT+X or unicode here:
 			keys = [key]
-			previous_load_mode = self.load_mode
-			self.set_load_mode(True)
 			for n in range(4):
 				getkey = self.win.getch()
 				if getkey is not -1:
@@ -188,7 +201,6 @@ class UI(DisplayableContainer):
 					elif keys[0] == 194:
 						keys = [ALT_KEY, keys[1] - 128]
 			self.handle_keys(*keys)
-			self.set_load_mode(previous_load_mode)
 			if self.settings.flushinput and not self.console.visible:
 				curses.flushinp()
 		else:
@@ -203,6 +215,7 @@ class UI(DisplayableContainer):
 				else:
 					if not self.fm.input_is_blocked():
 						self.handle_key(key)
+		return key != -1
 
 	def setup(self):
 		"""Build up the UI by initializing widgets."""
@@ -258,6 +271,7 @@ class UI(DisplayableContainer):
 
 	def update_size(self):
 		"""resize all widgets"""
+		_resize_curses()
 		self.termsize = self.win.getmaxyx()
 		y, x = self.termsize
 
@@ -208,6 +208,10 @@ class BrowserColumn(Pager):
 
 		self._set_scroll_begin()
 
+		# Stat the visible files in a worker instead of while drawing them
+		self.target.load_stats(self.target.files[self.scroll_begin:
+				self.scroll_begin + self.hei])
+
 		copied = [f.path for f in self.fm.copy_buffer]
 		ellipsis = self.ellipsis[self.settings.unicode_ellipsis]
 
@@ -228,8 +232,13 @@ class BrowserColumn(Pager):
 			else:
 				tagged_marker = " "
 
+			# Until its stat is loaded, the file is drawn without the
+			# attributes which would stat() it
+			deferred = drawn.stat_deferred
+			infostring = None if deferred else drawn.infostring
+
 			key = (self.wid, selected_i == i, drawn.marked, self.main_column,
-					drawn.path in copied, tagged_marker, drawn.infostring,
+					drawn.path in copied, tagged_marker, infostring,
 					self.fm.do_cut)
 
 			if key in drawn.display_data:
@@ -240,9 +249,9 @@ class BrowserColumn(Pager):
 			display_data = []
 			drawn.display_data[key] = display_data
 
-			if self.display_infostring and drawn.infostring \
+			if self.display_infostring and infostring \
 					and self.settings.display_size_in_main_column:
-				infostring = str(drawn.infostring) + " "
+				infostring = str(infostring) + " "
 			else:
 				infostring = ""
 
@@ -271,7 +280,7 @@ class BrowserColumn(Pager):
 			else:
 				this_color.append('file')
 
-			if drawn.stat:
+			if not deferred and drawn.stat:
 				mode = drawn.stat.st_mode
 				if mode & stat.S_IXUSR:
 					this_color.append('executable')
@@ -287,7 +296,8 @@ class BrowserColumn(Pager):
 
 			if drawn.is_link:
 				this_color.append('link')
-				this_color.append(drawn.exists and 'good' or 'bad')
+				if not deferred:
+					this_color.append(drawn.exists and 'good' or 'bad')
 
 			attr = self.settings.colorscheme.get_attr(*this_color)
 
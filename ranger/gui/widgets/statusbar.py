@@ -82,7 +82,7 @@ class StatusBar(Widget):
 		if not self.result:
 			self.need_redraw = True
 
-		if self.old_du and not self.fm.thisdir.disk_usage:
+		if self.old_du != self.fm.thisdir.disk_usage:
 			self.old_du = self.fm.thisdir.disk_usage
 			self.need_redraw = True
 
@@ -269,7 +269,7 @@ class StatusBar(Widget):
 			queue = self.fm.loader.queue
 			states = []
 			for item in queue:
-				if item.progressbar_supported:
+				if item.progressbar_supported and not item.silent:
 					states.append(item.percent)
 			if states:
 				state = sum(states) / len(states)
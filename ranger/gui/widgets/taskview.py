@@ -7,6 +7,7 @@ The TaskView allows you to modify what the loader is doing.
 
 from . import Widget
 from ranger.ext.accumulator import Accumulator
+from ranger.core.loader import MEGABYTE
 
 class TaskView(Widget, Accumulator):
 	old_lst = None
@@ -24,6 +25,8 @@ class TaskView(Widget, Accumulator):
 		if self.old_lst != lst:
 			self.old_lst = lst
 			self.need_redraw = True
+		elif any(obj.progressbar_supported for obj in lst):
+			self.need_redraw = True  # the statistics change all the time
 
 		if self.need_redraw:
 			self.win.erase()
@@ -51,10 +54,17 @@ class TaskView(Widget, Accumulator):
 						clr.append('selected')
 
 					descr = obj.get_description()
+					if self.fm.loader.is_blocked(obj):
+						descr += " (waiting for the disk)"
 					if obj.progressbar_supported and obj.percent >= 0 \
 							and obj.percent <= 100:
 						self.addstr(y, 0, "%3d%% - %s" % \
 								(obj.percent, descr), self.wid)
+						if obj.stats is not None:
+							summary = obj.stats.summary()
+							x = self.wid - len(summary) - 1
+							if x > len(descr) + 8:
+								self.addstr(y, x, summary)
 						wid = int(self.wid / 100.0 * obj.percent)
 						self.color_at(y, 0, self.wid, tuple(clr))
 						self.color_at(y, 0, wid, tuple(clr), 'loaded')
@@ -78,18 +88,60 @@ class TaskView(Widget, Accumulator):
 		if i is None:
 			i = self.pointer
 
-		if self.fm.loader.queue:
-			self.fm.loader.remove(index=i)
+		index = self._queue_index(i)
+		if index is not None:
+			self.fm.loader.remove(index=index)
 
 	def task_move(self, to, i=None):
 		if i is None:
 			i = self.pointer
 
-		self.fm.loader.move(_from=i, to=to)
+		index = self._queue_index(i)
+		if index is not None:
+			self.fm.loader.move(_from=index, to=to)
+
+	def _queue_index(self, i):
+		"""The index in the loader's queue of the i-th shown task"""
+		try:
+			obj = self.get_list()[i]
+		except IndexError:
+			return None
+		for index, item in enumerate(self.fm.loader.queue):
+			if item is obj:
+				return index
+		return None
+
+	def task_set_bandwidth(self, bandwidth, i=None):
+		"""Limit a copying task to that many MB/s, or not at all with 0"""
+		if i is None:
+			i = self.pointer
+		try:
+			obj = self.get_list()[i]
+		except IndexError:
+			return
+		if hasattr(obj, 'set_bandwidth'):
+			obj.set_bandwidth(bandwidth)
+			self.need_redraw = True
+
+	def task_scale_bandwidth(self, factor, i=None):
+		"""Multiply the limit of a copying task, starting at its speed"""
+		if i is None:
+			i = self.pointer
+		try:
+			obj = self.get_list()[i]
+		except IndexError:
+			return
+		if not hasattr(obj, 'get_bandwidth'):
+			return
+		bandwidth = obj.get_bandwidth()
+		if not bandwidth and factor < 1 and obj.stats is not None:
+			bandwidth = obj.stats.bytes_per_second / MEGABYTE
+		if bandwidth:
+			self.task_set_bandwidth(bandwidth * factor, i)
 
 	def press(self, key):
 		self.fm.ui.keymaps.use_keymap('taskview')
 		self.fm.ui.press(key)
 
 	def get_list(self):
-		return self.fm.loader.queue
+		return [item for item in self.fm.loader.queue if not item.silent]